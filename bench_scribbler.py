@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# Tai Sakuma <sakuma@cern.ch>
+import os, sys
+import time
+import json
+import socket
+import datetime
+import platform
+import argparse
+import subprocess
+
+try:
+    import resource
+except ImportError: # not on Unix
+    resource = None
+
+##__________________________________________________________________||
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'AlphaTwirl'))
+import alphatwirl
+
+##__________________________________________________________________||
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'utils'))
+import synthetic_event
+
+import scribbler
+import twirl
+
+if not hasattr(scribbler, 'Handle'): # not in CMSSW
+    scribbler.Handle = synthetic_event.Handle
+
+##__________________________________________________________________||
+parser = argparse.ArgumentParser(description = 'benchmark the scribblers and the tables of twirl.py with synthetic events')
+parser.add_argument('-n', '--nevents', default = 200, type = int, help = 'number of synthetic events')
+parser.add_argument('--seed', default = 1, type = int, help = 'seed for the synthetic events')
+parser.add_argument('--sparse', action = 'store_true', default = False, help = 'benchmark the scribblers in the sparse mode')
+parser.add_argument('--no-tables', action = 'store_true', default = False, help = 'benchmark only the scribblers')
+parser.add_argument('--no-memory', action = 'store_true', default = False, help = 'do not measure the growth of the peak memory of each reader')
+parser.add_argument('--results-path', default = os.path.join('bench', 'results.jsonl'), help = 'file to which the results are appended')
+parser.add_argument('--label', default = None, help = 'label of the results. the output of git describe by default')
+parser.add_argument('--compare-with', default = None, help = 'label of the results to compare with. the last results with a different label by default')
+parser.add_argument('--threshold', default = 0.1, type = float, help = 'fractional slowdown to be reported')
+
+##__________________________________________________________________||
+def main():
+
+    args = parser.parse_args()
+
+    label = args.label if args.label is not None else git_describe()
+
+    readers = build_readers(tables = not args.no_tables, sparse = args.sparse)
+
+    results = dict([(n, { }) for n, _ in readers])
+    max_rss_before = max_rss_mb()
+
+    # before the time so that the peak has not been reached yet
+    if not args.no_memory and max_rss_before is not None:
+        growth_per_reader = measure_peak_memory_growth(readers, args.nevents, args.seed)
+        for name, g in growth_per_reader.items():
+            results[name]['max_rss_growth_mb'] = g
+        readers = build_readers(tables = not args.no_tables, sparse = args.sparse)
+
+    time_per_reader = measure_time(readers, args.nevents, args.seed)
+    max_rss_after = max_rss_mb()
+    for name, t in time_per_reader.items():
+        results[name]['events_per_second'] = args.nevents/t if t > 0 else None
+
+    record = dict(
+        label = label,
+        time = '{:%Y-%m-%d %H:%M:%S}'.format(datetime.datetime.now()),
+        host = socket.gethostname(),
+        python = platform.python_version(),
+        nevents = args.nevents,
+        seed = args.seed,
+        results = results,
+    )
+    if max_rss_before is not None:
+        record['max_rss_mb'] = max_rss_after
+        record['max_rss_growth_mb'] = max_rss_after - max_rss_before
+
+    previous = load_records(args.results_path)
+    append_record(record, args.results_path)
+
+    reference = find_reference(previous, label, args.compare_with)
+    print_results([n for n, _ in readers], record, reference, args.threshold)
+
+##__________________________________________________________________||
+def build_readers(tables = True, sparse = False):
+    """return a list of (name, reader) in the order of twirl.py
+    """
+    ret = [(s.__class__.__name__, s) for s in twirl.build_scribblers(sparse = sparse)]
+    if not tables: return ret
+
+    tableConfigCompleter = alphatwirl.configure.TableConfigCompleter(
+        defaultSummaryClass = alphatwirl.summary.Count,
+        createOutFileName = alphatwirl.configure.TableFileNameComposer2()
+    )
+    tblcfg = [tableConfigCompleter.complete(c) for c in twirl.build_tblcfg()]
+    for c in tblcfg:
+        reader, _ = alphatwirl.configure.build_counter_collector_pair(c)
+        ret.append((c['outFileName'], reader))
+    return ret
+
+##__________________________________________________________________||
+def measure_time(readers, nevents, seed):
+    """return the total time in seconds spent in event() of each reader
+    """
+    events = synthetic_event.SyntheticEvents(nEvents = nevents, seed = seed)
+    for _, reader in readers:
+        if hasattr(reader, 'begin'): reader.begin(events)
+
+    ret = dict([(n, 0.0) for n, _ in readers])
+    timer = time.time
+    for event in events:
+        for name, reader in readers:
+            t0 = timer()
+            reader.event(event)
+            ret[name] += timer() - t0
+
+    for _, reader in readers:
+        if hasattr(reader, 'end'): reader.end()
+    return ret
+
+##__________________________________________________________________||
+def measure_peak_memory_growth(readers, nevents, seed):
+    """return the growth of the peak memory in MB in event() of each reader
+
+    The peak resident set size of the process is read before and after
+    each call of event(). The growth is summed up for each reader over
+    the events. The peak only goes up, so memory freed by a reader and
+    reused by later readers is not counted. The numbers show which
+    readers hold on to memory, e.g., in caches, not how much memory
+    they allocate per event, which `tracemalloc` would measure but is
+    not available in Python 2.
+
+    """
+    events = synthetic_event.SyntheticEvents(nEvents = nevents, seed = seed)
+    for _, reader in readers:
+        if hasattr(reader, 'begin'): reader.begin(events)
+
+    ret = dict([(n, 0.0) for n, _ in readers])
+    for event in events:
+        for name, reader in readers:
+            before = max_rss_mb()
+            reader.event(event)
+            ret[name] += max_rss_mb() - before
+
+    for _, reader in readers:
+        if hasattr(reader, 'end'): reader.end()
+    return ret
+
+def max_rss_mb():
+    """return the peak resident set size of this process in MB
+
+    `None` if not available, e.g., not on Unix.
+
+    """
+    if resource is None: return None
+    ret = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin': ret /= 1024.0 # bytes on macOS
+    return ret/1024.0
+
+##__________________________________________________________________||
+def git_describe():
+    this_dir = os.path.dirname(os.path.realpath(__file__))
+    try:
+        out = subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd = this_dir)
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+    return out.decode().strip()
+
+def load_records(path):
+    if not os.path.exists(path): return [ ]
+    with open(path) as f:
+        return [json.loads(l) for l in f if l.strip()]
+
+def append_record(record, path):
+    dirname = os.path.dirname(path)
+    if dirname: alphatwirl.mkdir_p(dirname)
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, sort_keys = True) + '\n')
+
+def find_reference(records, label, compare_with = None):
+    for r in reversed(records):
+        if compare_with is None and r['label'] != label: return r
+        if compare_with is not None and r['label'] == compare_with: return r
+    return None
+
+##__________________________________________________________________||
+def print_results(names, record, reference, threshold):
+    ref_results = reference['results'] if reference is not None else { }
+    if reference is not None:
+        print('compared with {} ({})'.format(reference['label'], reference['time']))
+    width = max([len(n) for n in names])
+    format_ = '{:<' + str(width) + 's} {:>12s} {:>14s} {:>9s}'
+    print(format_.format('reader', 'events/s', 'peak MB grown', 'change'))
+    for name in names:
+        res = record['results'][name]
+        rate = res['events_per_second']
+        growth = res.get('max_rss_growth_mb')
+        change = ''
+        ref_rate = ref_results.get(name, { }).get('events_per_second')
+        if rate and ref_rate:
+            ratio = rate/ref_rate - 1
+            change = '{:+.1%}'.format(ratio)
+            if ratio < -threshold: change += ' SLOWER'
+        print(format_.format(
+            name,
+            '{:.1f}'.format(rate) if rate else '-',
+            '{:.1f}'.format(growth) if growth is not None else '-',
+            change
+        ))
+    if any(['max_rss_growth_mb' in record['results'][n] for n in names]):
+        print('peak MB grown: growth of the peak RSS in event() of each reader, summed over the events. not the memory allocated per event')
+    if 'max_rss_growth_mb' in record:
+        line = 'peak RSS: {:.1f} MB, grew by {:.1f} MB while the readers ran'.format(
+            record['max_rss_mb'], record['max_rss_growth_mb'])
+        ref_rss = reference.get('max_rss_mb') if reference is not None else None
+        if ref_rss:
+            line += ' ({:+.1f} MB)'.format(record['max_rss_mb'] - ref_rss)
+        print(line)
+
+##__________________________________________________________________||
+if __name__ == '__main__':
+    main()
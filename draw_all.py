@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# Tai Sakuma <sakuma@cern.ch>
+import os, sys
+import glob
+import logging
+import argparse
+import subprocess
+import collections
+import multiprocessing.pool
+
+##__________________________________________________________________||
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'utils'))
+from freshness import all_outputs_are_newer_than_any_input
+
+##__________________________________________________________________||
+parser = argparse.ArgumentParser(
+    description = 'draw the figures of the draw_f*.R scripts in parallel. run reduce_tables.py first so that the scripts read the reduced tables'
+)
+parser.add_argument('r_args', nargs = '*', help = 'arguments to the R scripts, given after "--"')
+parser.add_argument('--scripts', default = None, nargs = '*', help = 'R scripts. draw_f*.R next to this script by default')
+parser.add_argument('-p', '--process', default = multiprocessing.cpu_count(), type = int, help = 'number of R processes to run in parallel')
+parser.add_argument('--force', action = 'store_true', default = False, help = 'redraw all figures')
+parser.add_argument('--list', action = 'store_true', default = False, help = 'only print the jobs to be run')
+parser.add_argument('--rscript', default = 'Rscript', help = 'command to run the R scripts')
+parser.add_argument('--logging-level', default = 'WARN', choices = ['DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'], help = 'level for logging')
+
+##__________________________________________________________________||
+class DrawJob(object):
+    """A set of figures drawn together by an R script
+
+    The jobs are listed by the R scripts with `draw.job()` in
+    `draw_jobs.R`.
+
+    """
+    def __init__(self, script, name, outputs, inputs):
+        self.script = script
+        self.name = name
+        self.outputs = outputs
+        self.inputs = inputs
+
+    def __repr__(self):
+        return '{}(script = {!r}, name = {!r}, outputs = {!r}, inputs = {!r})'.format(
+            self.__class__.__name__,
+            self.script,
+            self.name,
+            self.outputs,
+            self.inputs
+        )
+
+    def is_up_to_date(self):
+        return all_outputs_are_newer_than_any_input(self.outputs, self.inputs)
+
+##__________________________________________________________________||
+def list_jobs(rscript, script, r_args):
+    """return the list of the jobs of an R script
+
+    The script is run with the environment variable `DRAW_LIST_JOBS`,
+    with which it prints the jobs without drawing. `None` is returned
+    if the script fails.
+
+    """
+    out, err, returncode = run_rscript(rscript, script, r_args, dict(DRAW_LIST_JOBS = '1'))
+    if returncode != 0:
+        logger = logging.getLogger(__name__)
+        logger.error('cannot list the jobs of {}:\n{}'.format(script, err))
+        return None
+    ret = [ ]
+    for line in out.splitlines():
+        fields = line.rstrip('\n').split('\t')
+        if fields[0] != 'DRAW_JOB': continue
+        name, outputs, inputs = fields[1:4]
+        ret.append(DrawJob(script, name, outputs.split(','), [i for i in inputs.split(',') if i]))
+    return ret
+
+def run_rscript(rscript, script, r_args, env):
+    env_ = os.environ.copy()
+    env_.update(env)
+    proc = subprocess.Popen(
+        [rscript, script] + list(r_args),
+        stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+        env = env_, universal_newlines = True
+    )
+    out, err = proc.communicate()
+    return out, err, proc.returncode
+
+##__________________________________________________________________||
+class DrawScriptJobs(object):
+    """Run the jobs of an R script
+
+    The script is run with the environment variable `DRAW_ONLY`, with
+    which it only draws the given jobs. The jobs are given together if
+    they read the same tables, e.g., the components in
+    `draw_f010_levelplot.R`, so that the tables are read once for the
+    jobs in each chunk given by `group_jobs()`.
+
+    """
+    def __init__(self, rscript, r_args):
+        self.rscript = rscript
+        self.r_args = r_args
+
+    def __call__(self, args):
+        script, jobs = args
+        names = [j.name for j in jobs]
+        out, err, returncode = run_rscript(self.rscript, script, self.r_args, dict(DRAW_ONLY = ','.join(names)))
+        return script, names, err, returncode
+
+def group_jobs(jobs, nprocesses = 1):
+    """return a list of (script, jobs) for the jobs of each script with
+    the same inputs
+
+    The groups are split into chunks of about the same size until
+    there are at least `nprocesses` chunks or every job is in its own
+    chunk so that the jobs are drawn in parallel, e.g., the components
+    of `draw_f010_levelplot.R`, all of which read the same tables. The
+    tables are then read once for each chunk.
+
+    """
+    groups = collections.OrderedDict()
+    for j in jobs:
+        groups.setdefault((j.script, tuple(sorted(j.inputs))), [ ]).append(j)
+    groups = [(script, jj) for (script, _), jj in groups.items()]
+
+    # the number of chunks of each group. a chunk is added to the
+    # group with the largest chunks
+    nchunks = [1]*len(groups)
+    while sum(nchunks) < nprocesses:
+        sizes = [float(len(jj))/n if n < len(jj) else 0 for (_, jj), n in zip(groups, nchunks)]
+        if not sizes or max(sizes) == 0: break
+        nchunks[sizes.index(max(sizes))] += 1
+
+    ret = [ ]
+    for (script, jj), n in zip(groups, nchunks):
+        ret.extend([(script, jj[(i*len(jj)//n):((i + 1)*len(jj)//n)]) for i in range(n)])
+    return ret
+
+##__________________________________________________________________||
+def main():
+
+    args = parser.parse_args()
+
+    if args.scripts is None:
+        args.scripts = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'draw_f*.R')))
+
+    #
+    # configure logger
+    #
+    log_level = logging.getLevelName(args.logging_level)
+    logging.basicConfig(level = log_level, format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+
+    #
+    # list the jobs
+    #
+    # the R processes are run from threads
+    pool = multiprocessing.pool.ThreadPool(max(args.process, 1))
+    jobs = pool.map(lambda s: list_jobs(args.rscript, s, args.r_args), args.scripts)
+    failed = len([jj for jj in jobs if jj is None])
+    jobs = [j for jj in jobs if jj is not None for j in jj]
+
+    if not args.force:
+        jobs = [j for j in jobs if not j.is_up_to_date()]
+
+    if args.list:
+        for j in jobs:
+            print('{} {}'.format(os.path.basename(j.script), j.name))
+        if failed:
+            sys.exit(1)
+        return
+
+    #
+    # draw
+    #
+    # an R process for the jobs of each script that read the same tables
+    tasks = group_jobs(jobs, nprocesses = args.process)
+    logger.info('drawing {} jobs in {} R processes, {} at a time'.format(len(jobs), len(tasks), args.process))
+    for script, names, err, returncode in pool.imap_unordered(DrawScriptJobs(args.rscript, args.r_args), tasks):
+        if returncode != 0:
+            failed += 1
+            logger.error('{} {} failed:\n{}'.format(script, ','.join(names), err))
+            continue
+        logger.info('drawn: {} {}'.format(os.path.basename(script), ','.join(names)))
+    pool.close()
+    pool.join()
+
+    if failed:
+        sys.exit(1)
+
+##__________________________________________________________________||
+if __name__ == '__main__':
+    main()
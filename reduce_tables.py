@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# Tai Sakuma <sakuma@cern.ch>
+import os, sys
+import logging
+import argparse
+
+##__________________________________________________________________||
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'AlphaTwirl'))
+import alphatwirl
+
+##__________________________________________________________________||
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'utils'))
+import table_reduction
+from freshness import all_outputs_are_newer_than_any_input
+
+##__________________________________________________________________||
+parser = argparse.ArgumentParser(
+    description = 'write the small tables that the draw_f*.R scripts read instead of the tables written by twirl.py and twirl_scan.py'
+)
+parser.add_argument('-i', '--tbl-dir', default = os.path.join('tbl', 'out'), help = 'directory with the tables written by twirl.py and twirl_scan.py')
+parser.add_argument('-o', '--outdir', default = None, help = '"reduced" in the tbl dir by default, where the R scripts look for the reduced tables')
+parser.add_argument('--component-table', default = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tbl', 'tbl_component_src_particle_energy.txt'), help = 'table of the particle and energy of the gun for each component')
+parser.add_argument('--force', action = 'store_true', default = False, help = 'recreate all output files')
+parser.add_argument('--logging-level', default = 'WARN', choices = ['DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'], help = 'level for logging')
+
+##__________________________________________________________________||
+# the energies of the gun in draw_f040_QIE10_n.R and draw_f050_QIE10_log10n.R
+SRC_ENERGIES_QIE10 = (30, 50, 100, 150, 300)
+
+##__________________________________________________________________||
+def build_reductions():
+    """return a list of the reductions, each of which is a tuple of the
+    file name of the input table and a function that writes the reduced
+    table from the input path to the output path
+
+    """
+    ret = [ ]
+
+    # draw_f010_levelplot.R
+    ret.append((
+        'tbl_Scan.run.lumi.evt.ieta-wp.iphi-b1.depth-b1.idxQIE10-b1.eta-b1.phi-b1.energy-b1.energy_th-b1.txt',
+        lambda inPath, outPath, componentsPath: table_reduction.reduce_event_subset(
+            inPath, outPath,
+            columns = ['component', 'evt', 'ieta', 'iphi', 'depth', 'idxQIE10', 'energy_th']
+        )
+    ))
+
+    # draw_f020_gen_n.R, draw_f100_QIE10_energy_ratio.R
+    varnames = (
+        'gen_eta', 'gen_energy', 'gen_pdg', 'gen_phi',
+        'QIE10_energy_ratio', 'matched_energy_ratio', 'matched_energy_depth1', 'matched_energy_depth2',
+    )
+    for varname in varnames:
+        ret.append((
+            'tbl_n_component.{}-w.txt'.format(varname),
+            _reduce_counts(varname)
+        ))
+
+    # draw_f040_QIE10_n.R, draw_f050_QIE10_log10n.R
+    varnames = (
+        'energy_matched_summed', 'QIE10_charge', 'QIE10_energy', 'QIE10_energy_th',
+        'QIE10_nRaw', 'QIE10_soi', 'QIE10_timeRising', 'QIE10_timeFalling',
+    )
+    for varname in varnames:
+        ret.append((
+            'tbl_n_component.depth-wp.idxQIE10-b1.{}-b1.txt'.format(varname),
+            _reduce_counts(varname, src_energies = SRC_ENERGIES_QIE10)
+        ))
+
+    return ret
+
+def _reduce_counts(varname, src_energies = None):
+    def ret(inPath, outPath, componentsPath):
+        table_reduction.reduce_counts(
+            inPath, outPath, varname, componentsPath,
+            src_energies = src_energies
+        )
+    return ret
+
+##__________________________________________________________________||
+def main():
+
+    args = parser.parse_args()
+
+    if args.outdir is None:
+        args.outdir = os.path.join(args.tbl_dir, 'reduced')
+
+    #
+    # configure logger
+    #
+    log_level = logging.getLevelName(args.logging_level)
+    logging.basicConfig(level = log_level, format = '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    logger = logging.getLogger(__name__)
+
+    #
+    # reduce
+    #
+    alphatwirl.mkdir_p(args.outdir)
+    for tblFileName, reduce_ in build_reductions():
+        inPath = table_reduction.table_path(args.tbl_dir, tblFileName)
+        if not os.path.exists(inPath): continue
+        outPath = os.path.join(args.outdir, tblFileName)
+        if not args.force and all_outputs_are_newer_than_any_input([outPath], [inPath, args.component_table]):
+            logger.info('up to date: {}'.format(outPath))
+            continue
+        logger.info('reducing {} into {}'.format(inPath, outPath))
+        # renamed at the end so that an interrupted reduction does not
+        # leave a table that looks up to date
+        tmpPath = outPath + '.tmp'
+        reduce_(inPath, tmpPath, args.component_table)
+        os.rename(tmpPath, outPath)
+
+##__________________________________________________________________||
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,6 @@
 # Tai Sakuma <sakuma@cern.ch>
 import os
+import math
 import pandas as pd
 import numpy as np
 
@@ -152,10 +153,7 @@ class HFPreRecHitEtaPhi(object):
         self.hfrechit_phi = [ ]
         self._attach_to_event(event)
 
-        this_dir = os.path.realpath(os.path.dirname(__file__))
-        tbl_dir = os.path.join(this_dir, 'tbl')
-        tbl_path = os.path.join(tbl_dir, 'tbl_HF_ieta_iphi_eta_phi.txt')
-        self.tbl_eta_phi = pd.read_table(tbl_path, delim_whitespace = True)
+        self.tbl_eta_phi = read_table_cached(default_tbl_eta_phi_path())
 
     def _attach_to_event(self, event):
         event.hfrechit_eta = self.hfrechit_eta
@@ -195,8 +193,73 @@ class HFPreRecHit_QIE10_energy_th(object):
         self._attach_to_event(event)
         self.hfrechit_QIE10_energy_th[:] = [(e if e >= self.min_energy else 0) for e in event.hfrechit_QIE10_energy]
 
+##__________________________________________________________________||
+class HFPreRecHitSparse(object):
+    """the hits with energy above the threshold with their eta and phi
+
+    The hits with nonzero `hfrechit_QIE10_energy_th` are kept.
+    `hfrechit_sparse_index` is the index of the hit in the lists of
+    `HFPreRecHit`. This class can be used in place of
+    `HFPreRecHitEtaPhi` for `QIE10MergedDepth(sparse = True)`.
+
+    """
+    def begin(self, event):
+        self.hfrechit_sparse_index = [ ]
+        self.hfrechit_sparse_ieta = [ ]
+        self.hfrechit_sparse_iphi = [ ]
+        self.hfrechit_sparse_depth = [ ]
+        self.hfrechit_sparse_QIE10_index = [ ]
+        self.hfrechit_sparse_energy = [ ]
+        self.hfrechit_sparse_eta = [ ]
+        self.hfrechit_sparse_phi = [ ]
+        self._attach_to_event(event)
+
+        self.eta_phi = read_eta_phi_map(default_tbl_eta_phi_path())
+
+    def _attach_to_event(self, event):
+        event.hfrechit_sparse_index = self.hfrechit_sparse_index
+        event.hfrechit_sparse_ieta = self.hfrechit_sparse_ieta
+        event.hfrechit_sparse_iphi = self.hfrechit_sparse_iphi
+        event.hfrechit_sparse_depth = self.hfrechit_sparse_depth
+        event.hfrechit_sparse_QIE10_index = self.hfrechit_sparse_QIE10_index
+        event.hfrechit_sparse_energy = self.hfrechit_sparse_energy
+        event.hfrechit_sparse_eta = self.hfrechit_sparse_eta
+        event.hfrechit_sparse_phi = self.hfrechit_sparse_phi
+
+    def event(self, event):
+        self._attach_to_event(event)
+
+        energy = event.hfrechit_QIE10_energy_th
+        idx = [i for i, e in enumerate(energy) if e > 0]
+
+        ieta = [event.hfrechit_ieta[i] for i in idx]
+        iphi = [event.hfrechit_iphi[i] for i in idx]
+        depth = [event.hfrechit_depth[i] for i in idx]
+        nan = (float('nan'), float('nan'))
+        eta_phi = [self.eta_phi.get(k, nan) for k in zip(ieta, iphi, depth)]
+
+        self.hfrechit_sparse_index[:] = idx
+        self.hfrechit_sparse_ieta[:] = ieta
+        self.hfrechit_sparse_iphi[:] = iphi
+        self.hfrechit_sparse_depth[:] = depth
+        self.hfrechit_sparse_QIE10_index[:] = [event.hfrechit_QIE10_index[i] for i in idx]
+        self.hfrechit_sparse_energy[:] = [energy[i] for i in idx]
+        self.hfrechit_sparse_eta[:] = [e for e, _ in eta_phi]
+        self.hfrechit_sparse_phi[:] = [p for _, p in eta_phi]
+
 ##__________________________________________________________________||
 class QIE10MergedDepth(object):
+    """merge the two depths of each HF channel
+
+    In the sparse mode, only the channels with energy above the
+    threshold in at least one depth are merged from the hits given by
+    `HFPreRecHitSparse`. The other channels, which have zero energy
+    in both depths, are omitted.
+
+    """
+    def __init__(self, sparse = False):
+        self.sparse = sparse
+
     def begin(self, event):
         self.QIE10MergedDepth_ieta = [ ]
         self.QIE10MergedDepth_iphi = [ ]
@@ -222,9 +285,16 @@ class QIE10MergedDepth(object):
         event.QIE10MergedDepth_phi_depth1 = self.QIE10MergedDepth_phi_depth1
         event.QIE10MergedDepth_phi_depth2 = self.QIE10MergedDepth_phi_depth2
 
+        if self.sparse:
+            self.eta_phi = read_eta_phi_map(default_tbl_eta_phi_path())
+
     def event(self, event):
         self._attach_to_event(event)
 
+        if self.sparse:
+            self._merge_sparse(event)
+            return
+
         df = pd.DataFrame({
             'ieta': event.hfrechit_ieta,
             'iphi': event.hfrechit_iphi,
@@ -254,6 +324,31 @@ class QIE10MergedDepth(object):
         self.QIE10MergedDepth_phi_depth1[:] = df.phi_1
         self.QIE10MergedDepth_phi_depth2[:] = df.phi_2
 
+    def _merge_sparse(self, event):
+        energy = { }
+        for ieta, iphi, index, depth, e in zip(
+                event.hfrechit_sparse_ieta, event.hfrechit_sparse_iphi,
+                event.hfrechit_sparse_QIE10_index, event.hfrechit_sparse_depth,
+                event.hfrechit_sparse_energy):
+            energy.setdefault((ieta, iphi, index), { })[depth] = e
+        keys = sorted(energy)
+        nan = (float('nan'), float('nan'))
+        eta_phi_1 = [self.eta_phi.get((k[0], k[1], 1), nan) for k in keys]
+        eta_phi_2 = [self.eta_phi.get((k[0], k[1], 2), nan) for k in keys]
+        energy_1 = [float(energy[k].get(1, 0)) for k in keys]
+        energy_2 = [float(energy[k].get(2, 0)) for k in keys]
+
+        self.QIE10MergedDepth_ieta[:] = [k[0] for k in keys]
+        self.QIE10MergedDepth_iphi[:] = [k[1] for k in keys]
+        self.QIE10MergedDepth_index[:] = [k[2] for k in keys]
+        self.QIE10MergedDepth_energy_depth1[:] = energy_1
+        self.QIE10MergedDepth_energy_depth2[:] = energy_2
+        self.QIE10MergedDepth_energy_ratio[:] = [(e1/e2 if e2 > 0 else 0) for e1, e2 in zip(energy_1, energy_2)]
+        self.QIE10MergedDepth_eta_depth1[:] = [e for e, _ in eta_phi_1]
+        self.QIE10MergedDepth_eta_depth2[:] = [e for e, _ in eta_phi_2]
+        self.QIE10MergedDepth_phi_depth1[:] = [p for _, p in eta_phi_1]
+        self.QIE10MergedDepth_phi_depth2[:] = [p for _, p in eta_phi_2]
+
     def end(self):
         pass
 
@@ -299,6 +394,27 @@ class QIE10Ag(object):
 
 ##__________________________________________________________________||
 class GenMatching(object):
+    """match the merged-depth channels to the generator particles
+
+    The matching in the sparse mode gives the same results in plain
+    Python loops without pandas, which is faster for the small number
+    of channels given by `QIE10MergedDepth(sparse = True)`.
+
+    The channels within the cone of `maxdr` = 0.2 in both depths with
+    positive energy in both depths are matched. Variations of the cone
+    size and the energy cut can be given as a list of dicts with the
+    keys `name`, `maxdr`, and `min_energy`, e.g.,
+    `dict(name = 'dr0p3', maxdr = 0.3)`. The distances are computed
+    once, and the results of each variation are attached to the event
+    as `GenMatchedSummed_<name>_gen_index` etc in the same event loop.
+
+    """
+    variation_varnames = ('gen_index', 'qie_index', 'energy_depth1', 'energy_depth2', 'energy_ratio')
+
+    def __init__(self, sparse = False, variations = ( )):
+        self.sparse = sparse
+        self.variations = [dict(dict(maxdr = 0.2, min_energy = 0), **v) for v in variations]
+
     def begin(self, event):
         self.GenMatchedSummed_gen_index = [ ]
         self.GenMatchedSummed_qie_index = [ ]
@@ -311,6 +427,8 @@ class GenMatching(object):
         self.GenMatchedSummedDepthEnergy_depth = [ ]
         self.GenMatchedSummedDepthEnergy_energy = [ ]
 
+        self.variation_lists = [dict([(n, [ ]) for n in self.variation_varnames]) for _ in self.variations]
+
         self._attach_to_event(event)
 
     def _attach_to_event(self, event):
@@ -325,9 +443,17 @@ class GenMatching(object):
         event.GenMatchedSummedDepthEnergy_depth = self.GenMatchedSummedDepthEnergy_depth
         event.GenMatchedSummedDepthEnergy_energy = self.GenMatchedSummedDepthEnergy_energy
 
+        for variation, lists in zip(self.variations, self.variation_lists):
+            for n, l in lists.items():
+                setattr(event, 'GenMatchedSummed_{}_{}'.format(variation['name'], n), l)
+
     def event(self, event):
         self._attach_to_event(event)
 
+        if self.sparse:
+            self._match_sparse(event)
+            return
+
         df_gen = pd.DataFrame(dict(
             gen_eta = event.genParticle_eta,
             gen_phi = event.genParticle_phi
@@ -382,6 +508,74 @@ class GenMatching(object):
         self.GenMatchedSummedDepthEnergy_depth[:] = df_summed_depth_energy['depth']
         self.GenMatchedSummedDepthEnergy_energy[:] = df_summed_depth_energy['energy']
 
+        for variation, lists in zip(self.variations, self.variation_lists):
+            df_variation = df[
+                (df['dr1'] <= variation['maxdr']) & (df['dr2'] <= variation['maxdr']) &
+                (df['energy_depth1'] > variation['min_energy']) & (df['energy_depth2'] > variation['min_energy'])
+            ]
+            df_variation = df_variation.groupby(['gen_index', 'qie_index'])['energy_depth1', 'energy_depth2'].sum().reset_index()
+            lists['gen_index'][:] = df_variation.gen_index
+            lists['qie_index'][:] = df_variation.qie_index
+            lists['energy_depth1'][:] = df_variation.energy_depth1
+            lists['energy_depth2'][:] = df_variation.energy_depth2
+            lists['energy_ratio'][:] = df_variation.energy_depth1/df_variation.energy_depth2
+
+    def _match_sparse(self, event):
+        maxdr = 0.2
+        maxdr_all = max([maxdr] + [v['maxdr'] for v in self.variations])
+
+        qies = [q for q in zip(
+            event.QIE10MergedDepth_index,
+            event.QIE10MergedDepth_energy_depth1, event.QIE10MergedDepth_energy_depth2,
+            event.QIE10MergedDepth_eta_depth1, event.QIE10MergedDepth_eta_depth2,
+            event.QIE10MergedDepth_phi_depth1, event.QIE10MergedDepth_phi_depth2
+        ) if q[1] > 0 and q[2] > 0]
+
+        # the pairs of a gen particle and a channel within the largest cone
+        pairs = [ ]
+        for gen_index, (gen_eta, gen_phi) in enumerate(zip(event.genParticle_eta, event.genParticle_phi)):
+            for qie_index, energy1, energy2, eta1, eta2, phi1, phi2 in qies:
+                dr1 = math.sqrt(abs(gen_eta - eta1)**2 + math.acos(math.cos(gen_phi - phi1))**2)
+                if not dr1 <= maxdr_all: continue
+                dr2 = math.sqrt(abs(gen_eta - eta2)**2 + math.acos(math.cos(gen_phi - phi2))**2)
+                if not dr2 <= maxdr_all: continue
+                pairs.append((gen_index, qie_index, energy1, energy2, max(dr1, dr2)))
+
+        keys, summed = _sum_matched_pairs(pairs, maxdr = maxdr, min_energy = 0)
+
+        self.GenMatchedSummed_gen_index[:] = [k[0] for k in keys]
+        self.GenMatchedSummed_qie_index[:] = [k[1] for k in keys]
+        self.GenMatchedSummed_energy_depth1[:] = [summed[k][0] for k in keys]
+        self.GenMatchedSummed_energy_depth2[:] = [summed[k][1] for k in keys]
+        self.GenMatchedSummed_energy_ratio[:] = [summed[k][0]/summed[k][1] for k in keys]
+
+        self.GenMatchedSummedDepthEnergy_gen_index[:] = [k[0] for k in keys]*2
+        self.GenMatchedSummedDepthEnergy_qie_index[:] = [k[1] for k in keys]*2
+        self.GenMatchedSummedDepthEnergy_depth[:] = [1]*len(keys) + [2]*len(keys)
+        self.GenMatchedSummedDepthEnergy_energy[:] = [summed[k][0] for k in keys] + [summed[k][1] for k in keys]
+
+        for variation, lists in zip(self.variations, self.variation_lists):
+            keys, summed = _sum_matched_pairs(pairs, maxdr = variation['maxdr'], min_energy = variation['min_energy'])
+            lists['gen_index'][:] = [k[0] for k in keys]
+            lists['qie_index'][:] = [k[1] for k in keys]
+            lists['energy_depth1'][:] = [summed[k][0] for k in keys]
+            lists['energy_depth2'][:] = [summed[k][1] for k in keys]
+            lists['energy_ratio'][:] = [summed[k][0]/summed[k][1] for k in keys]
+
+##__________________________________________________________________||
+def _sum_matched_pairs(pairs, maxdr, min_energy):
+    # sum the energies of the channels matched to each gen particle.
+    # returns the sorted keys (gen_index, qie_index) and a dict of
+    # [energy_depth1, energy_depth2]
+    summed = { }
+    for gen_index, qie_index, energy1, energy2, dr in pairs:
+        if not dr <= maxdr: continue
+        if not (energy1 > min_energy and energy2 > min_energy): continue
+        e = summed.setdefault((gen_index, qie_index), [0, 0])
+        e[0] += energy1
+        e[1] += energy2
+    return sorted(summed), summed
+
 ##__________________________________________________________________||
 class Scratch(object):
     def begin(self, event):
@@ -424,7 +618,38 @@ class Scratch(object):
         self.handleHFPreRecHit = None
 
 ##__________________________________________________________________||
-from DataFormats.FWLite import Handle
-# https://github.com/cms-sw/cmssw/blob/CMSSW_8_1_X/DataFormats/FWLite/python/__init__.py
+def default_tbl_eta_phi_path():
+    this_dir = os.path.realpath(os.path.dirname(__file__))
+    tbl_dir = os.path.join(this_dir, 'tbl')
+    return os.path.join(tbl_dir, 'tbl_HF_ieta_iphi_eta_phi.txt')
+
+_table_cache = { }
+
+def read_table_cached(path):
+    # read a table once in a process. the table is shared by the
+    # copies of the scribblers, which are created for each event
+    # loop, and must not be modified.
+    if path not in _table_cache:
+        _table_cache[path] = pd.read_table(path, delim_whitespace = True)
+    return _table_cache[path]
+
+_eta_phi_map_cache = { }
+
+def read_eta_phi_map(path):
+    # a dict {(ieta, iphi, depth): (eta, phi)}, read once in a process
+    if path not in _eta_phi_map_cache:
+        tbl = read_table_cached(path)
+        _eta_phi_map_cache[path] = dict(zip(
+            zip(tbl.ieta.tolist(), tbl.iphi.tolist(), tbl.hfdepth.tolist()),
+            zip(tbl.eta.tolist(), tbl.phi.tolist())
+        ))
+    return _eta_phi_map_cache[path]
+
+##__________________________________________________________________||
+try:
+    from DataFormats.FWLite import Handle
+    # https://github.com/cms-sw/cmssw/blob/CMSSW_8_1_X/DataFormats/FWLite/python/__init__.py
+except ImportError:
+    pass
 
 ##__________________________________________________________________||
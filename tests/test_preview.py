@@ -0,0 +1,87 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os, sys
+import collections
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+import preview
+
+##__________________________________________________________________||
+Config = collections.namedtuple('Config', 'name inputPaths start maxEvents')
+
+class MockEvents(object):
+    # random access to the events like CMSEDMEvents
+    def __init__(self, nEvents, start = 0):
+        self.nEvents = nEvents
+        self.start = start
+        self.iEvent = -1
+        self.read = [ ]
+
+    def __iter__(self):
+        for self.iEvent in range(self.nEvents):
+            self.read.append(self.start + self.iEvent)
+            yield self
+        self.iEvent = -1
+
+class MockEventBuilder(object):
+    def __init__(self, config, nEvents):
+        self.config = config
+        self.nEvents = nEvents
+        self.events = None
+
+    def __call__(self):
+        self.events = MockEvents(self.nEvents, start = self.config.start)
+        return self.events
+
+class MockSplitter(object):
+    def __init__(self, eventBuilders):
+        self.eventBuilders = eventBuilders
+
+    def __call__(self, dataset):
+        return self.eventBuilders
+
+def build_splitter(fraction):
+    eventBuilders = [
+        MockEventBuilder(Config('ds', ['a.root'], 0, -1), 100),
+        MockEventBuilder(Config('ds', ['b.root'], 20, 50), 50),
+    ]
+    return eventBuilders, preview.SamplingSplitter(MockSplitter(eventBuilders), fraction, nStrata = 4)
+
+def run(eventBuilder):
+    events = eventBuilder()
+    weight = preview.PreviewWeight()
+    return [(e.iEvent, weight(e)) for e in events]
+
+##__________________________________________________________________||
+def test_fraction_one_reads_all_events_with_weight_one():
+    eventBuilders, splitter = build_splitter(1.0)
+    sampled = splitter(None)
+    assert len(sampled) == len(eventBuilders)
+    for s, b in zip(sampled, eventBuilders):
+        assert run(s) == [(i, 1.0) for i in range(b.nEvents)]
+        assert b.events.read == list(range(b.config.start, b.config.start + b.nEvents))
+
+def test_fraction_above_one_is_one():
+    _, splitter = build_splitter(1.5)
+    assert [w for _, w in run(splitter(None)[0])] == [1.0]*100
+
+def test_sample_reads_only_blocks_in_one_event_builder_per_task():
+    eventBuilders, splitter = build_splitter(0.2)
+    sampled = splitter(None)
+    assert len(sampled) == len(eventBuilders)
+    result = run(sampled[0])
+    events = eventBuilders[0].events
+    assert len(events.read) == 20 # 4 strata of 25 events, 5 events each
+    assert [i for i, _ in result] == list(range(20))
+    assert sum([w for _, w in result]) == 100
+    # restored after the iteration
+    assert (events.start, events.nEvents) == (0, 100)
+
+def test_sample_is_reproducible():
+    eventBuilders, splitter = build_splitter(0.2)
+    run(splitter(None)[1])
+    read1 = eventBuilders[1].events.read
+    run(splitter(None)[1])
+    assert eventBuilders[1].events.read == read1
+    assert all([20 <= i < 70 for i in read1])
+
+##__________________________________________________________________||
@@ -0,0 +1,56 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os, sys
+
+import pytest
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'AlphaTwirl'))
+alphatwirl = pytest.importorskip('alphatwirl')
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+import synthetic_event
+import scribbler
+import twirl
+
+if not hasattr(scribbler, 'Handle'): # not in CMSSW
+    scribbler.Handle = synthetic_event.Handle
+
+##__________________________________________________________________||
+def build_tables(sparse, nevents = 30, seed = 3):
+    # return a dict of the rows of the tables of twirl.py, with the gen
+    # matching variations, read from synthetic events
+
+    # HFPreRecHit and HFPreRecHit_QIE10_energy_th are dense in both
+    # modes because the tables of the hits are filled with all hits
+    tableConfigCompleter = alphatwirl.configure.TableConfigCompleter(
+        defaultSummaryClass = alphatwirl.summary.Count,
+        createOutFileName = alphatwirl.configure.TableFileNameComposer2()
+    )
+    variations = twirl.GEN_MATCHING_VARIATIONS
+    tblcfg = [tableConfigCompleter.complete(c) for c in twirl.build_tblcfg(gen_matching_variations = variations)]
+    pairs = [alphatwirl.configure.build_counter_collector_pair(c) for c in tblcfg]
+    readers = twirl.build_scribblers(sparse = sparse, gen_matching_variations = variations) + [r for r, _ in pairs]
+
+    events = synthetic_event.SyntheticEvents(nEvents = nevents, seed = seed, ngen = 2)
+    for reader in readers:
+        if hasattr(reader, 'begin'): reader.begin(events)
+    for event in events:
+        for reader in readers:
+            reader.event(event)
+    for reader in readers:
+        if hasattr(reader, 'end'): reader.end()
+
+    return dict([(c['outFileName'], collector.resultsCombinationMethod.combine([('synthetic', (reader, ))]))
+                 for c, (reader, collector) in zip(tblcfg, pairs)])
+
+##__________________________________________________________________||
+def test_sparse_tables_equal_dense_tables():
+    dense = build_tables(sparse = False)
+    sparse = build_tables(sparse = True)
+    assert sorted(sparse.keys()) == sorted(dense.keys())
+    for name in dense:
+        assert sparse[name] == dense[name], name
+    # the gen matching is tested only if there are matched hits
+    assert [n for n in dense if 'matched' in n and dense[n] and len(dense[n]) > 1]
+
+##__________________________________________________________________||
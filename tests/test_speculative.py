@@ -0,0 +1,134 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os, sys
+import gzip
+import shutil
+import tempfile
+
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+import pytest
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'AlphaTwirl'))
+alphatwirl = pytest.importorskip('alphatwirl')
+
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', 'utils'))
+import speculative
+
+##__________________________________________________________________||
+class MockDispatcher(object):
+    # runs nothing. the test finishes the runs with finish() as run.py
+    # would, by writing the result next to the package
+    def __init__(self):
+        self.runs = { } # runid -> (workingArea, package_path)
+        self.finished = [ ]
+        self.cancelled = [ ]
+        self.failed = [ ]
+
+    def run(self, workingArea, package_index):
+        runid = len(self.runs)
+        self.runs[runid] = (workingArea, workingArea.package_path(package_index))
+        return runid
+
+    def finish(self, runid, result = None):
+        workingArea, package_path = self.runs[runid]
+        if result is not None:
+            resultdir = os.path.join(workingArea.path, 'results', package_path.split('.', 1)[0])
+            os.makedirs(resultdir)
+            with gzip.open(os.path.join(resultdir, 'result.p.gz'), 'wb') as f:
+                pickle.dump(result, f)
+        self.finished.append(runid)
+
+    def poll(self):
+        ret = self.finished
+        self.finished = [ ]
+        return ret
+
+    def failed_runids(self, runids):
+        self.failed.extend(runids)
+
+    def cancel(self, runids):
+        self.cancelled.extend(runids)
+
+    def terminate(self):
+        pass
+
+class Task(object):
+    def __call__(self):
+        pass
+
+def build_dropbox(topdir, **kwargs):
+    workingArea = alphatwirl.concurrently.WorkingArea(dir = topdir, python_modules = [ ])
+    dispatcher = MockDispatcher()
+    dropbox = speculative.SpeculativeTaskPackageDropbox(workingArea, dispatcher, sleep = 0, **kwargs)
+    dropbox.open()
+    return dropbox, dispatcher
+
+def put(dropbox):
+    package = alphatwirl.concurrently.TaskPackage(task = Task(), args = (), kwargs = { })
+    return dropbox.put(package)
+
+##__________________________________________________________________||
+def test_copy_working_area():
+    topdir = tempfile.mkdtemp()
+    try:
+        dropbox, dispatcher = build_dropbox(topdir)
+        put(dropbox)
+        workingArea = dropbox.workingArea
+        copy = speculative._CopyWorkingArea(workingArea, 1)
+        assert copy.path == workingArea.path
+        assert copy.topdir == workingArea.topdir
+        assert copy.package_path(0) == 'task_00000_1.p.gz'
+        assert speculative._CopyWorkingArea(workingArea, 0).package_path(0) == workingArea.package_path(0)
+        copy.put_copy(0)
+        assert os.path.exists(os.path.join(workingArea.path, 'task_00000_1.p.gz'))
+        dropbox.close()
+    finally:
+        shutil.rmtree(topdir)
+
+def test_resubmit_failed_package():
+    topdir = tempfile.mkdtemp()
+    try:
+        dropbox, dispatcher = build_dropbox(topdir)
+        put(dropbox)
+        dispatcher.finish(0) # fails, no result
+
+        # the package is resubmitted from its copy
+        assert dropbox._finished(dispatcher.poll()[0]) is None
+        assert dispatcher.failed == [0]
+        workingArea, package_path = dispatcher.runs[1]
+        assert package_path == 'task_00000_1.p.gz'
+        assert os.path.exists(os.path.join(workingArea.path, package_path))
+
+        dispatcher.finish(1, result = 'result')
+        assert dropbox.receive() == ['result']
+        assert workingArea.collect_result(0) == 'result'
+        dropbox.close()
+    finally:
+        shutil.rmtree(topdir)
+
+def test_duplicate_of_straggler():
+    topdir = tempfile.mkdtemp()
+    try:
+        dropbox, dispatcher = build_dropbox(topdir, min_finished = 1)
+        put(dropbox)
+        put(dropbox)
+        dispatcher.finish(0, result = 'result0')
+        dropbox._finished(dispatcher.poll()[0])
+
+        # the second package has been running for long
+        dropbox.runid_start_time[1] -= 100
+        dropbox._launch_duplicates_of_stragglers()
+        assert dispatcher.runs[2][1] == 'task_00001_1.p.gz'
+
+        # the duplicate finishes first. the original is cancelled
+        dispatcher.finish(2, result = 'result1')
+        assert dropbox.receive() == ['result1']
+        assert dispatcher.cancelled == [1]
+        dropbox.close()
+    finally:
+        shutil.rmtree(topdir)
+
+##__________________________________________________________________||
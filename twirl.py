@@ -11,45 +11,50 @@ import alphatwirl
 ##__________________________________________________________________||
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'utils'))
 import framework_cmsedm
+import twirl_options
+import spilling_collector
+import columnar_event
+import preview
 
 import scribbler
 
 ##__________________________________________________________________||
 parser = argparse.ArgumentParser()
-parser.add_argument("--input-files", default = [ ], nargs = '*', help = "list of input files")
-parser.add_argument("--dataset-names", default = [ ], nargs = '*', help = "list of data set names")
-parser.add_argument('-o', '--outdir', default = os.path.join('tbl', 'out'))
-parser.add_argument('-n', '--nevents', default = -1, type = int, help = 'maximum number of events to process for each component')
-parser.add_argument('--max-events-per-process', default = -1, type = int, help = 'maximum number of events per process')
-parser.add_argument('--max-files-per-dataset', default = -1, type = int, help = 'maximum number of files per data set')
-parser.add_argument('--max-files-per-process', default = 1, type = int, help = 'maximum number of files per process')
-parser.add_argument('--force', action = 'store_true', default = False, help = 'recreate all output files')
-
-parser.add_argument('--parallel-mode', default = 'multiprocessing', choices = ['multiprocessing', 'subprocess', 'htcondor'], help = 'mode for concurrency')
-parser.add_argument('-p', '--process', default = 4, type = int, help = 'number of processes to run in parallel')
-parser.add_argument('-q', '--quiet', default = False, action = 'store_true', help = 'quiet mode')
-parser.add_argument('--profile', action = 'store_true', help = 'run profile')
-parser.add_argument('--profile-out-path', default = None, help = 'path to write the result of profile')
-parser.add_argument('--logging-level', default = 'WARN', choices = ['DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'], help = 'level for logging')
-args = parser.parse_args()
+twirl_options.add_dataset_arguments(parser)
+parser.add_argument('-o', '--outdir', default = None, help = 'tbl/out by default. tbl/preview in the preview mode')
+parser.add_argument('--sparse', action = 'store_true', default = False, help = 'merge depths and match to generator particles only for hits above the threshold')
+parser.add_argument('--gen-matching-variations', action = 'store_true', default = False, help = 'also produce the tables of the gen matching with the cone sizes and energy cuts in GEN_MATCHING_VARIATIONS')
+parser.add_argument('--preview-fraction', default = None, type = float, help = 'preview mode: sample this fraction of events in strata over all files and scale the tables to estimates for all events')
+parser.add_argument('--preview-minutes', default = None, type = float, help = 'preview mode: sample the fraction of events that can be processed in about these minutes, based on the recorded runtime')
+parser.add_argument('--preview-strata', default = 10, type = int, help = 'number of strata of events in each process in the preview mode')
+parser.add_argument('--preview-seed', default = 1, type = int, help = 'seed for sampling events in the preview mode')
+parser.add_argument('--input-format', default = 'cmsedm', choices = ['cmsedm', 'npz'], help = 'format of the input files. npz files are read without CMSSW')
+parser.add_argument('--skim-outdir', default = None, help = 'write the contents of the EDM files read by the scribblers into npz files in this directory. in the htcondor mode, it needs to be on a file system shared with the worker nodes')
+twirl_options.add_framework_arguments(parser, process = 4)
+
+##__________________________________________________________________||
+GEN_MATCHING_VARIATIONS = [
+    dict(name = 'dr0p1', maxdr = 0.1),
+    dict(name = 'dr0p3', maxdr = 0.3),
+    dict(name = 'e5', min_energy = 5),
+    dict(name = 'e10', min_energy = 10),
+]
 
 ##__________________________________________________________________||
 def main():
 
+    args = parser.parse_args()
+
+    twirl_options.check_arguments(parser, args)
+
+    preview_mode = args.preview_fraction is not None or args.preview_minutes is not None
+    if args.outdir is None:
+        args.outdir = os.path.join('tbl', 'preview' if preview_mode else 'out')
+
     #
     # configure logger
     #
-    log_level = logging.getLevelName(args.logging_level)
-    log_handler = logging.StreamHandler()
-    log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    log_handler.setFormatter(log_formatter)
-
-    names_for_logger = ["framework_cmsedm", "alphatwirl"]
-    for n in names_for_logger:
-        logger = logging.getLogger(n)
-        logger.setLevel(log_level)
-        logger.handlers[:] = [ ]
-        logger.addHandler(log_handler)
+    twirl_options.configure_logger(args)
 
     #
     #
@@ -59,23 +64,118 @@ def main():
     #
     # configure scribblers
     #
+    gen_matching_variations = GEN_MATCHING_VARIATIONS if args.gen_matching_variations else ( )
     NullCollector = alphatwirl.loop.NullCollector
-    reader_collector_pairs.extend([
-        (scribbler.EventAuxiliary(), NullCollector()),
-        (scribbler.MET(),            NullCollector()),
-        (scribbler.GenParticle(),    NullCollector()),
-        (scribbler.HFPreRecHit(),    NullCollector()),
-        (scribbler.HFPreRecHit_QIE10_energy_th(min_energy = 3),    NullCollector()),
-        (scribbler.HFPreRecHitEtaPhi(), NullCollector()),
-        (scribbler.QIE10MergedDepth(), NullCollector()),
-        (scribbler.GenMatching(), NullCollector()),
-        # (scribbler.QIE10Ag(),        NullCollector()),
-        # (scribbler.Scratch(),        NullCollector()),
-        ])
+    reader_collector_pairs.extend([(s, NullCollector()) for s in build_scribblers(
+        edm = args.input_format == 'cmsedm',
+        sparse = args.sparse,
+        gen_matching_variations = gen_matching_variations
+    )])
+    if args.skim_outdir:
+        if args.parallel_mode == 'htcondor':
+            logger = logging.getLogger('framework_cmsedm')
+            logger.warning('the npz files are written in {} on the worker nodes. they are lost unless it is on a shared file system'.format(args.skim_outdir))
+        # absolute because the processes run in the working area in the
+        # subprocess mode
+        reader_collector_pairs.append((build_skim_writer(os.path.abspath(args.skim_outdir)), NullCollector()))
 
     #
     # configure tables
     #
+    tblcfg = build_tblcfg(gen_matching_variations = gen_matching_variations)
+
+    # complete table configs
+    # in the preview mode, the tables are weighted to estimate the
+    # tables of all events. the column nvar gives the variance.
+    tableConfigCompleter = alphatwirl.configure.TableConfigCompleter(
+        defaultSummaryClass = alphatwirl.summary.Count,
+        defaultWeight = preview.PreviewWeight() if preview_mode else alphatwirl.summary.WeightCalculatorOne(),
+        defaultOutDir = args.outdir,
+        createOutFileName = alphatwirl.configure.TableFileNameComposer2()
+    )
+    tblcfg = [tableConfigCompleter.complete(c) for c in tblcfg]
+
+    # do not recreate tables that already exist unless the force option is used
+    if not args.force:
+        tblcfg = [c for c in tblcfg if c['outFile'] and not os.path.exists(c['outFilePath'])]
+
+    if args.max_rows_in_memory > 0:
+        reader_collector_pairs.extend(
+            [spilling_collector.build_counter_spilling_collector_pair(
+                c, maxRowsInMemory = args.max_rows_in_memory, tmpDir = args.outdir,
+                spillInWorkers = args.parallel_mode != 'htcondor'
+            ) for c in tblcfg]
+        )
+    else:
+        reader_collector_pairs.extend(
+            [alphatwirl.configure.build_counter_collector_pair(c) for c in tblcfg]
+        )
+
+    #
+    # configure data sets
+    #
+    datasets = framework_cmsedm.build_datasets(args.dataset_names, args.input_files)
+
+    #
+    # run
+    #
+    preview_fraction = args.preview_fraction
+    if args.preview_minutes is not None:
+        preview_fraction = preview.fraction_for_time_budget(
+            framework_cmsedm.ResourceUsage(args.resource_usage_path) if args.resource_usage_path else None,
+            datasets, seconds = args.preview_minutes*60,
+            processes = None if args.parallel_mode == 'htcondor' else args.process
+        )
+
+    fw = twirl_options.build_framework(
+        args, datasets,
+        event_builder = args.input_format,
+        preview_fraction = preview_fraction,
+        preview_strata = args.preview_strata,
+        preview_seed = args.preview_seed
+    )
+    fw.run(
+        datasets = datasets,
+        reader_collector_pairs = reader_collector_pairs
+    )
+
+##__________________________________________________________________||
+def build_scribblers(edm = True, sparse = False, gen_matching_variations = ( )):
+    # the attributes that the scribblers in edm_scribblers attach are
+    # in the npz files, written by build_skim_writer()
+    edm_scribblers = [
+        scribbler.EventAuxiliary(),
+        scribbler.MET(),
+        scribbler.GenParticle(),
+        scribbler.HFPreRecHit(),
+    ] if edm else [ ]
+    return edm_scribblers + [
+        scribbler.HFPreRecHit_QIE10_energy_th(min_energy = 3),
+        scribbler.HFPreRecHitSparse() if sparse else scribbler.HFPreRecHitEtaPhi(),
+        scribbler.QIE10MergedDepth(sparse = sparse),
+        scribbler.GenMatching(sparse = sparse, variations = gen_matching_variations),
+        # scribbler.QIE10Ag(),
+        # scribbler.Scratch(),
+    ]
+
+##__________________________________________________________________||
+def build_skim_writer(outdir):
+    return columnar_event.ColumnarSkimWriter(
+        attrNames = (
+            'run', 'lumi', 'eventId',
+            'pfMet',
+            'nGenParticles',
+            'genParticle_pdgId', 'genParticle_eta', 'genParticle_phi', 'genParticle_energy',
+            'hfrechit_ieta', 'hfrechit_iphi', 'hfrechit_depth', 'hfrechit_QIE10_index',
+            'hfrechit_QIE10_charge', 'hfrechit_QIE10_energy',
+            'hfrechit_QIE10_timeRising', 'hfrechit_QIE10_timeFalling',
+            'hfrechit_QIE10_nRaw', 'hfrechit_QIE10_soi',
+        ),
+        outDir = outdir
+    )
+
+##__________________________________________________________________||
+def build_tblcfg(gen_matching_variations = ( )):
     Binning = alphatwirl.binning.Binning
     Echo = alphatwirl.binning.Echo
     Round = alphatwirl.binning.Round
@@ -119,74 +219,14 @@ def main():
         dict(keyAttrNames = ('GenMatchedSummed_qie_index', 'GenMatchedSummed_energy_ratio', ),  keyIndices = (None, '*'), binnings = (echo, Round(0.5, 0, valid = greater_than_zero)), keyOutColumnNames = ('idxQIE10', 'matched_energy_ratio')),
         dict(keyAttrNames = ('GenMatchedSummedDepthEnergy_depth', 'GenMatchedSummedDepthEnergy_qie_index', 'GenMatchedSummedDepthEnergy_energy'),      keyIndices = ('(*)', '\\1', '\\1'), binnings = (echo, echo, Round(0.1, 0)), keyOutColumnNames = ('depth', 'idxQIE10', 'energy_matched_summed')),
     ]
-
-    # complete table configs
-    tableConfigCompleter = alphatwirl.configure.TableConfigCompleter(
-        defaultSummaryClass = alphatwirl.summary.Count,
-        defaultOutDir = args.outdir,
-        createOutFileName = alphatwirl.configure.TableFileNameComposer2()
-    )
-    tblcfg = [tableConfigCompleter.complete(c) for c in tblcfg]
-
-    # do not recreate tables that already exist unless the force option is used
-    if not args.force:
-        tblcfg = [c for c in tblcfg if c['outFile'] and not os.path.exists(c['outFilePath'])]
-
-    reader_collector_pairs.extend(
-        [alphatwirl.configure.build_counter_collector_pair(c) for c in tblcfg]
-    )
-
-    #
-    # configure data sets
-    #
-    dataset_names = args.dataset_names if args.dataset_names else args.input_files
-    datasets = [framework_cmsedm.Dataset(n, [f]) for n, f in zip(dataset_names, args.input_files)]
-
-    #
-    # run
-    #
-    htcondor_job_desc_extra_request = ['request_memory = 250']
-
-    # https://lists.cs.wisc.edu/archive/htcondor-users/2014-June/msg00133.shtml
-    # hold a job and release to a different machine after a certain minutes
-    htcondor_job_desc_extra_resubmit = [
-        'expected_runtime_minutes = 10',
-        'job_machine_attrs = Machine',
-        'job_machine_attrs_history_length = 4',
-        'requirements = target.machine =!= MachineAttrMachine1 && target.machine =!= MachineAttrMachine2 &&  target.machine =!= MachineAttrMachine3',
-        'periodic_hold = JobStatus == 2 && CurrentTime - EnteredCurrentStatus > 60 * $(expected_runtime_minutes)',
-        'periodic_hold_subcode = 1',
-        'periodic_release = HoldReasonCode == 3 && HoldReasonSubCode == 1 && JobRunCount < 3',
-        'periodic_hold_reason = ifthenelse(JobRunCount<3,"Ran too long, will retry","Ran too long")',
-    ]
-
-    # http://www.its.hku.hk/services/research/htc/jobsubmission
-    # avoid the machines "smXX.hadoop.cluster"
-    # operator '=!=' explained at https://research.cs.wisc.edu/htcondor/manual/v7.8/4_1HTCondor_s_ClassAd.html#ClassAd:evaluation-meta
-    htcondor_job_desc_extra_blacklist = [
-        'requirements = strcmp(substr(Target.Machine,0,2),"sm") =!= 0 && strcmp(substr(Target.Machine,4,15),".hadoop.cluster") =!= 0'
-    ]
-
-    ## htcondor_job_desc_extra = htcondor_job_desc_extra_request + htcondor_job_desc_extra_resubmit
-    htcondor_job_desc_extra = htcondor_job_desc_extra_request + htcondor_job_desc_extra_blacklist
-
-    fw =  framework_cmsedm.FrameworkCMSEDM(
-        quiet = args.quiet,
-        parallel_mode = args.parallel_mode,
-        htcondor_job_desc_extra = htcondor_job_desc_extra,
-        process = args.process,
-        user_modules = ('scribbler', ),
-        max_events_per_dataset = args.nevents,
-        max_events_per_process = args.max_events_per_process,
-        max_files_per_dataset = args.max_files_per_dataset,
-        max_files_per_process = args.max_files_per_process,
-        profile = args.profile,
-        profile_out_path = args.profile_out_path
-    )
-    fw.run(
-        datasets = datasets,
-        reader_collector_pairs = reader_collector_pairs
-    )
+    for variation in gen_matching_variations:
+        name = variation['name']
+        tblcfg.extend([
+            dict(keyAttrNames = ('GenMatchedSummed_{}_qie_index'.format(name), 'GenMatchedSummed_{}_energy_depth1'.format(name)), keyIndices = (None, '*'), binnings = (echo, Round(0.1, 0, valid = greater_than_zero)), keyOutColumnNames = ('idxQIE10', 'matched_{}_energy_depth1'.format(name))),
+            dict(keyAttrNames = ('GenMatchedSummed_{}_qie_index'.format(name), 'GenMatchedSummed_{}_energy_depth2'.format(name)), keyIndices = (None, '*'), binnings = (echo, Round(0.1, 0, valid = greater_than_zero)), keyOutColumnNames = ('idxQIE10', 'matched_{}_energy_depth2'.format(name))),
+            dict(keyAttrNames = ('GenMatchedSummed_{}_qie_index'.format(name), 'GenMatchedSummed_{}_energy_ratio'.format(name)),  keyIndices = (None, '*'), binnings = (echo, Round(0.5, 0, valid = greater_than_zero)), keyOutColumnNames = ('idxQIE10', 'matched_{}_energy_ratio'.format(name))),
+        ])
+    return tblcfg
 
 ##__________________________________________________________________||
 def greater_than_zero(x): return x > 0
@@ -3,58 +3,60 @@
 import os, sys
 import argparse
 
-import ROOT
+##__________________________________________________________________||
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'AlphaTwirl'))
+import alphatwirl
 
-import AlphaTwirl
-import Framework
-import Scribbler
+##__________________________________________________________________||
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), 'utils'))
+import framework_cmsedm
+import twirl_options
+import spilling_collector
 
-ROOT.gROOT.SetBatch(1)
+import scribbler
 
 ##__________________________________________________________________||
 parser = argparse.ArgumentParser()
-parser.add_argument("--input-files", default = [ ], nargs = '*', help = "list of input files")
-parser.add_argument("--dataset-names", default = [ ], nargs = '*', help = "list of data set names")
-parser.add_argument("-p", "--process", default = 1, type = int, help = "number of processes to run in parallel")
+twirl_options.add_dataset_arguments(parser)
 parser.add_argument('-o', '--outdir', default = os.path.join('tbl', 'out'))
-parser.add_argument('-q', '--quiet', action = 'store_true', default = False, help = 'quiet mode')
-parser.add_argument('-n', '--nevents', default = -1, type = int, help = 'maximum number of events to process for each component')
-parser.add_argument('--max-events-per-process', default = -1, type = int, help = 'maximum number of events per process')
-parser.add_argument('--force', action = 'store_true', default = False, help = 'recreate all output files')
+parser.add_argument('--scan-format', default = 'txt', choices = ['txt', 'parquet'], help = 'format of the output tables. the Parquet tables are always merged on disk with --max-rows-in-memory 1000000 unless given')
+twirl_options.add_framework_arguments(parser, process = 1)
 args = parser.parse_args()
+twirl_options.check_arguments(parser, args)
 
 ##__________________________________________________________________||
 def main():
 
+    #
+    # configure logger
+    #
+    twirl_options.configure_logger(args)
+
+    #
+    #
+    #
     reader_collector_pairs = [ ]
 
     #
     # configure scribblers
     #
-    NullCollector = AlphaTwirl.Loop.NullCollector
+    NullCollector = alphatwirl.loop.NullCollector
     reader_collector_pairs.extend([
-        (Scribbler.EventAuxiliary(), NullCollector()),
-        (Scribbler.MET(),            NullCollector()),
-        (Scribbler.GenParticle(),    NullCollector()),
-        (Scribbler.HFPreRecHit(),    NullCollector()),
-        (Scribbler.HFPreRecHit_QIE10_energy_th(min_energy = 3),    NullCollector()),
-        (Scribbler.HFPreRecHitEtaPhi(), NullCollector()),
-        (Scribbler.QIE10MergedDepth(), NullCollector()),
-        (Scribbler.GenMatching(), NullCollector()),
-        # (Scribbler.QIE10Ag(),        NullCollector()),
-        # (Scribbler.Scratch(),        NullCollector()),
+        (scribbler.EventAuxiliary(), NullCollector()),
+        (scribbler.MET(),            NullCollector()),
+        (scribbler.GenParticle(),    NullCollector()),
+        (scribbler.HFPreRecHit(),    NullCollector()),
+        (scribbler.HFPreRecHit_QIE10_energy_th(min_energy = 3),    NullCollector()),
+        (scribbler.HFPreRecHitEtaPhi(), NullCollector()),
+        (scribbler.QIE10MergedDepth(), NullCollector()),
+        (scribbler.GenMatching(), NullCollector()),
+        # (scribbler.QIE10Ag(),        NullCollector()),
+        # (scribbler.Scratch(),        NullCollector()),
         ])
 
     #
     # configure tables
     #
-    Binning = AlphaTwirl.Binning.Binning
-    Echo = AlphaTwirl.Binning.Echo
-    Round = AlphaTwirl.Binning.Round
-    RoundLog = AlphaTwirl.Binning.RoundLog
-    Combine = AlphaTwirl.Binning.Combine
-    echo = Echo(nextFunc = None)
-    echoNextPlusOne = Echo()
     tblcfg = [
         dict(
             keyAttrNames = (
@@ -69,7 +71,7 @@ def main():
                 None, None, None,
                 '(*)', '\\1', '\\1', '\\1',
             ),
-            summaryClass = AlphaTwirl.Summary.Scan,
+            summaryClass = alphatwirl.summary.Scan,
         ),
         dict(
             keyAttrNames = (
@@ -90,7 +92,7 @@ def main():
                 'eta', 'phi'
             ),
             valOutColumnNames = ('energy', 'energy_th'),
-            summaryClass = AlphaTwirl.Summary.Scan,
+            summaryClass = alphatwirl.summary.Scan,
         ),
         dict(
             keyAttrNames = (
@@ -115,7 +117,7 @@ def main():
                 'eta_depth2', 'phi_depth2', 'energy_depth2',
                 'energy_ratio',
             ),
-            summaryClass = AlphaTwirl.Summary.Scan,
+            summaryClass = alphatwirl.summary.Scan,
         ),
         dict(
             keyAttrNames = (
@@ -133,41 +135,54 @@ def main():
                 None, None, None,
                 '(*)', '\\1', '\\1', '\\1', '\\1'
             ),
-            summaryClass = AlphaTwirl.Summary.Scan,
+            summaryClass = alphatwirl.summary.Scan,
         ),
     ]
 
     # complete table configs
-    tableConfigCompleter = AlphaTwirl.Configure.TableConfigCompleter(
-        defaultSummaryClass = AlphaTwirl.Summary.Count,
+    tableConfigCompleter = alphatwirl.configure.TableConfigCompleter(
+        defaultSummaryClass = alphatwirl.summary.Count,
         defaultOutDir = args.outdir,
-        createOutFileName = AlphaTwirl.Configure.TableFileNameComposer2()
+        createOutFileName = alphatwirl.configure.TableFileNameComposer2()
     )
     tblcfg = [tableConfigCompleter.complete(c) for c in tblcfg]
 
+    if args.scan_format == 'parquet':
+        for c in tblcfg:
+            if not c['outFile']: continue
+            c['outFileName'] = os.path.splitext(c['outFileName'])[0] + '.parquet'
+            c['outFilePath'] = os.path.splitext(c['outFilePath'])[0] + '.parquet'
+
     # do not recreate tables that already exist unless the force option is used
     if not args.force:
         tblcfg = [c for c in tblcfg if c['outFile'] and not os.path.exists(c['outFilePath'])]
 
-    reader_collector_pairs.extend(
-        [AlphaTwirl.Configure.build_counter_collector_pair(c) for c in tblcfg]
-    )
+    # the Parquet tables are always streamed by the spilling collector
+    max_rows_in_memory = args.max_rows_in_memory
+    if args.scan_format == 'parquet' and max_rows_in_memory <= 0:
+        max_rows_in_memory = 1000000
+
+    if max_rows_in_memory > 0:
+        reader_collector_pairs.extend(
+            [spilling_collector.build_counter_spilling_collector_pair(
+                c, maxRowsInMemory = max_rows_in_memory, tmpDir = args.outdir,
+                spillInWorkers = args.parallel_mode != 'htcondor'
+            ) for c in tblcfg]
+        )
+    else:
+        reader_collector_pairs.extend(
+            [alphatwirl.configure.build_counter_collector_pair(c) for c in tblcfg]
+        )
 
     #
     # configure data sets
     #
-    dataset_names = args.dataset_names if args.dataset_names else args.input_files
-    datasets = [Framework.Dataset(n, [f]) for n, f in zip(dataset_names, args.input_files)]
+    datasets = framework_cmsedm.build_datasets(args.dataset_names, args.input_files)
 
     #
     # run
     #
-    fw =  Framework.Framework(
-        quiet = args.quiet,
-        process = args.process,
-        max_events_per_dataset = args.nevents,
-        max_events_per_process = args.max_events_per_process
-    )
+    fw = twirl_options.build_framework(args, datasets)
     fw.run(
         datasets = datasets,
         reader_collector_pairs = reader_collector_pairs
@@ -0,0 +1,222 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os
+
+import numpy as np
+
+import alphatwirl
+from alphatwirl.cmsedm.EventBuilderConfig import EventBuilderConfig
+
+##__________________________________________________________________||
+OFFSETS_SUFFIX = '.offsets'
+
+##__________________________________________________________________||
+class NpzEvents(object):
+    """Events in columnar npz files
+
+    Each attribute of the events is stored in the npz file as a flat
+    array of the values of all events, `name`, and an array of the
+    offsets, `name.offsets`, whose length is the number of the events
+    plus one. The values of the i-th event are
+    `name[name.offsets[i]:name.offsets[i+1]]`. Such files are written
+    by `ColumnarSkimWriter`.
+
+    The attributes are lists, like the ones that the scribblers attach
+    to the event. The same list objects are updated in place for every
+    event so that the readers can hold them from `begin()`.
+
+    Args:
+        paths (list): the paths to the npz files
+        maxEvents (int): the maximum number of events. -1 for no limit
+        start (int): the index of the first event in the files
+
+    """
+    def __init__(self, paths, maxEvents = -1, start = 0):
+
+        if start < 0:
+            raise ValueError("start must be greater than or equal to zero: {} is given".format(start))
+
+        self.paths = paths
+
+        nevents_in_files = [nevents_in_npz(p) for p in paths]
+        nevents_in_dataset = sum(nevents_in_files)
+        start = min(nevents_in_dataset, start)
+        if maxEvents > -1:
+            self.nEvents = min(nevents_in_dataset - start, maxEvents)
+        else:
+            self.nEvents = nevents_in_dataset - start
+        self.nevents_in_files = nevents_in_files
+        self.maxEvents = maxEvents
+        self.start = start
+        self.iEvent = -1
+
+        self.attrnames = attribute_names_in_npz(paths[0]) if paths else [ ]
+        for name in self.attrnames:
+            setattr(self, name, [ ])
+        self._columns = (None, None) # the path and the columns last loaded
+
+    def __repr__(self):
+        return '{}(paths = {!r}, maxEvents = {!r}, start = {!r}, nEvents = {!r}, iEvent = {!r})'.format(
+            self.__class__.__name__,
+            self.paths,
+            self.maxEvents,
+            self.start,
+            self.nEvents,
+            self.iEvent
+        )
+
+    def __iter__(self):
+        attrs = [(n, getattr(self, n)) for n in self.attrnames]
+        self.iEvent = 0
+        file_start = 0
+        for path, nevents in zip(self.paths, self.nevents_in_files):
+            begin = max(self.start - file_start, 0)
+            end = min(self.start + self.nEvents - file_start, nevents)
+            file_start += nevents
+            if begin >= end: continue
+            columns = self._load(path)
+            for i in range(begin, end):
+                for name, attr in attrs:
+                    content, offsets = columns[name]
+                    attr[:] = content[offsets[i]:offsets[i + 1]].tolist()
+                yield self
+                self.iEvent += 1
+        self.iEvent = -1
+
+    def _load(self, path):
+        # the columns are kept because the events can be iterated over
+        # again with different start and nEvents, e.g., by SampledEvents
+        if self._columns[0] != path:
+            self._columns = (path, load_npz(path, self.attrnames))
+        return self._columns[1]
+
+##__________________________________________________________________||
+class NpzEventBuilder(object):
+    def __init__(self, config):
+        self.config = config
+
+    def __repr__(self):
+        return '{}({!r})'.format(
+            self.__class__.__name__,
+            self.config
+        )
+
+    def __call__(self):
+        events = NpzEvents(
+            paths = self.config.inputPaths,
+            maxEvents = self.config.maxEvents,
+            start = self.config.start
+        )
+        events.config = self.config
+        events.dataset = self.config.dataset.name
+        return events
+
+##__________________________________________________________________||
+class NpzEventBuilderConfigMaker(object):
+    """The counterpart of `alphatwirl.cmsedm.EventBuilderConfigMaker`
+    for npz files
+
+    """
+    def create_config_for(self, dataset, files, start, length):
+        config = EventBuilderConfig(
+            inputPaths = files,
+            maxEvents = length,
+            start = start,
+            dataset = dataset, # for scribblers
+            name = dataset.name # for the progress report writer
+        )
+        return config
+
+    def file_list_in(self, dataset, maxFiles):
+        if maxFiles < 0:
+            return dataset.files
+        return dataset.files[:min(maxFiles, len(dataset.files))]
+
+    def nevents_in_file(self, path):
+        return nevents_in_npz(path)
+
+##__________________________________________________________________||
+class ColumnarSkimWriter(object):
+    """A reader that writes attributes of events into an npz file
+
+    The npz file can be read by `NpzEvents` so that the events can be
+    processed again without CMSSW. One file is written for each event
+    builder, i.e., for each process, in the directory `outDir/dataset`.
+
+    The files are written where the process runs. `outDir` needs to be
+    an absolute path in the subprocess mode, in which the processes run
+    in the working area. In the htcondor mode, the files are not
+    transferred back unless `outDir` is on a file system shared with
+    the worker nodes.
+
+    Args:
+        attrNames (list): the names of the attributes of the event to
+                          be written
+        outDir (str): the directory of the output files
+
+    """
+    def __init__(self, attrNames, outDir):
+        self.attrNames = tuple(attrNames)
+        self.outDir = outDir
+
+    def __repr__(self):
+        return '{}(attrNames = {!r}, outDir = {!r})'.format(
+            self.__class__.__name__,
+            self.attrNames,
+            self.outDir
+        )
+
+    def begin(self, event):
+        self.outPath = self._compose_out_path(event)
+        self._values = dict([(n, [ ]) for n in self.attrNames])
+        self._counts = dict([(n, [ ]) for n in self.attrNames])
+
+    def event(self, event):
+        for name in self.attrNames:
+            val = getattr(event, name)
+            self._values[name].extend(val)
+            self._counts[name].append(len(val))
+
+    def end(self):
+        arrays = { }
+        for name in self.attrNames:
+            arrays[name] = np.array(self._values[name])
+            arrays[name + OFFSETS_SUFFIX] = np.concatenate(([0], np.cumsum(self._counts[name], dtype = np.int64)))
+        dirname = os.path.dirname(self.outPath)
+        if dirname: alphatwirl.mkdir_p(dirname)
+        tmp = self.outPath + '.tmp.npz'
+        np.savez_compressed(tmp, **arrays)
+        os.rename(tmp, self.outPath)
+        self._values = None
+        self._counts = None
+
+    def _compose_out_path(self, event):
+        config = getattr(event, 'config', None)
+        if config is None:
+            return os.path.join(self.outDir, 'skim.npz')
+        first = os.path.splitext(os.path.basename(config.inputPaths[0]))[0]
+        name = '{}_{}_{}.npz'.format(first, len(config.inputPaths), config.start)
+        return os.path.join(self.outDir, config.name, name)
+
+##__________________________________________________________________||
+def attribute_names_in_npz(path):
+    with np.load(path) as f:
+        return sorted([n for n in f.files if not n.endswith(OFFSETS_SUFFIX)])
+
+def nevents_in_npz(path):
+    with np.load(path) as f:
+        names = [n for n in f.files if n.endswith(OFFSETS_SUFFIX)]
+        if not names: return 0
+        return len(f[names[0]]) - 1
+
+def load_npz(path, names):
+    # returns a dict {name: (content, offsets)} of the arrays. only the
+    # slice of each event is converted to a list, in NpzEvents, so that
+    # the values are Python objects, as the values that the scribblers
+    # attach to the event
+    ret = { }
+    with np.load(path) as f:
+        for name in names:
+            ret[name] = (f[name], f[name + OFFSETS_SUFFIX])
+    return ret
+
+##__________________________________________________________________||
@@ -0,0 +1,63 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import logging
+
+import alphatwirl
+
+##__________________________________________________________________||
+class EventRangeSplitter(alphatwirl.loop.DatasetIntoEventBuildersSplitter):
+    """Split data sets with few files into event ranges
+
+    A data set is split into at least `nRanges` processes, each of
+    which reads a range of events (file, start, length), if the data
+    set would otherwise be split into fewer processes, e.g., a data
+    set of one large file. The number of events per process is chosen
+    so that the events are evenly shared but is not less than
+    `minEventsPerRange`. The results of the ranges are merged in the
+    same way as the results of files.
+
+    This class falls back to the base class if the number of events
+    per process is given or if the data set has enough files. The
+    number of events in the files is only needed in the former case,
+    for which a `file_index.CachedEventBuilderConfigMaker` avoids
+    opening the files.
+
+    """
+    def __init__(self, nRanges, minEventsPerRange = 1000, **kwargs):
+        super(EventRangeSplitter, self).__init__(**kwargs)
+        self.nRanges = nRanges
+        self.minEventsPerRange = minEventsPerRange
+
+    def _file_start_length_list(self, dataset, maxEvents = -1, maxEventsPerRun = -1,
+                                maxFiles = -1, maxFilesPerRun = 1):
+        base = super(EventRangeSplitter, self)._file_start_length_list
+        if self.nRanges <= 1 or maxEventsPerRun >= 0:
+            return base(dataset, maxEvents, maxEventsPerRun, maxFiles, maxFilesPerRun)
+
+        files = self.eventBuilderConfigMaker.file_list_in(dataset, maxFiles = maxFiles)
+        if maxFilesPerRun < 0:
+            nprocesses = min(len(files), 1)
+        else:
+            nprocesses = -(-len(files)//max(maxFilesPerRun, 1)) # ceiling
+        if nprocesses >= self.nRanges:
+            return base(dataset, maxEvents, maxEventsPerRun, maxFiles, maxFilesPerRun)
+
+        file_nevents_list = self._file_nevents_list_for(dataset, maxEvents = maxEvents, maxFiles = maxFiles)
+        nevents = sum([n for _, n in file_nevents_list])
+        if 0 <= maxEvents < nevents:
+            nevents = maxEvents
+        if nevents == 0:
+            return base(dataset, maxEvents, maxEventsPerRun, maxFiles, maxFilesPerRun)
+
+        maxEventsPerRun = max(-(-nevents//self.nRanges), self.minEventsPerRange)
+        ret = self.create_file_start_length_list(
+            file_nevents_list = file_nevents_list,
+            max_events_per_run = maxEventsPerRun,
+            max_events_total = maxEvents,
+            max_files_per_run = maxFilesPerRun
+        )
+
+        logger = logging.getLogger(__name__)
+        logger.info('{}: {} events in {} files split into {} ranges'.format(dataset.name, nevents, len(files), len(ret)))
+        return ret
+
+##__________________________________________________________________||
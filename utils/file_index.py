@@ -0,0 +1,198 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os
+import json
+import logging
+import multiprocessing
+
+try:
+    from DataFormats.FWLite import Events as EDMEvents
+    from DataFormats.FWLite import Lumis as EDMLumis
+    # https://github.com/cms-sw/cmssw/blob/CMSSW_8_1_X/DataFormats/FWLite/python/__init__.py
+except ImportError:
+    pass
+
+import alphatwirl
+from alphatwirl.cmsedm.load_fwlite import load_fwlite
+
+import columnar_event
+
+##__________________________________________________________________||
+class FileIndex(object):
+    """The number of events and the run and lumi ranges of input files
+
+    The entries are stored in a JSON file keyed by the file path. Each
+    entry has the size and the modification time of the file when it
+    was scanned. An entry is used only while they are unchanged so
+    that the index can be kept across runs without the files being
+    opened again. The size and the modification time are `None` for
+    files that cannot be `stat`-ed, e.g., files on xrootd. Their
+    entries are always used.
+
+    Args:
+        path (str): the path to the JSON file
+        scan: a function that takes the path of an input file and
+              returns a dict with the keys `nevents` and `runs`, e.g.,
+              `scan_edm_file()` or `scan_npz_file()`
+
+    """
+    def __init__(self, path, scan = None):
+        self.path = path
+        self.scan = scan if scan is not None else scan_edm_file
+        self.entries = { }
+        self._load()
+
+    def __repr__(self):
+        return '{}(path = {!r}, scan = {!r})'.format(
+            self.__class__.__name__,
+            self.path,
+            self.scan
+        )
+
+    def _load(self):
+        if not os.path.exists(self.path): return
+        with open(self.path) as f:
+            self.entries = json.load(f)
+
+    def save(self):
+        dirname = os.path.dirname(self.path)
+        if dirname: alphatwirl.mkdir_p(dirname)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent = 1, sort_keys = True)
+        os.rename(tmp, self.path)
+
+    def get(self, path):
+        """return the entry for the file or `None` if it is stale"""
+        entry = self.entries.get(path)
+        if entry is None: return None
+        if (entry['size'], entry['mtime']) != file_stat(path): return None
+        return entry
+
+    def nevents(self, path):
+        entry = self.get(path)
+        if entry is None:
+            self.refresh([path])
+            entry = self.entries[path]
+        return entry['nevents']
+
+    def refresh(self, paths, processes = 4):
+        """scan the files whose entries are missing or stale in parallel
+
+        The index is saved if any file is scanned. Returns the number of
+        files scanned.
+
+        """
+        paths = sorted(set([p for p in paths if self.get(p) is None]))
+        if not paths: return 0
+
+        logger = logging.getLogger(__name__)
+        logger.info('{}: scanning {} files'.format(self.path, len(paths)))
+
+        if processes > 1 and len(paths) > 1:
+            pool = multiprocessing.Pool(min(processes, len(paths)))
+            try:
+                entries = pool.map(_ScanWithStat(self.scan), paths, chunksize = 1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            entries = [_ScanWithStat(self.scan)(p) for p in paths]
+
+        self.entries.update(dict(zip(paths, entries)))
+        self.save()
+        return len(paths)
+
+##__________________________________________________________________||
+class _ScanWithStat(object):
+    # a picklable function for multiprocessing.Pool.map()
+    def __init__(self, scan):
+        self.scan = scan
+
+    def __call__(self, path):
+        size, mtime = file_stat(path)
+        entry = self.scan(path)
+        entry.update(dict(size = size, mtime = mtime))
+        return entry
+
+##__________________________________________________________________||
+class CachedEventBuilderConfigMaker(object):
+    """An event builder config maker that reads the number of events
+    from a `FileIndex`
+
+    This class wraps another config maker, e.g.,
+    `alphatwirl.cmsedm.EventBuilderConfigMaker`, to which the other
+    methods are delegated.
+
+    The files are scanned only when their numbers of events are asked
+    for, which the splitter does not do if neither the maximum number
+    of events per data set nor per process is given. If a file in the
+    last list from `file_list_in()` needs to be scanned, it is scanned
+    together with the files that follow it in the list, up to
+    `processes` files, in parallel. The splitter usually asks for them
+    next.
+
+    """
+    def __init__(self, configMaker, fileIndex, processes = 1):
+        self.configMaker = configMaker
+        self.fileIndex = fileIndex
+        self.processes = processes
+        self._files = [ ]
+
+    def __repr__(self):
+        return '{}(configMaker = {!r}, fileIndex = {!r}, processes = {!r})'.format(
+            self.__class__.__name__,
+            self.configMaker,
+            self.fileIndex,
+            self.processes
+        )
+
+    def create_config_for(self, dataset, files, start, length):
+        return self.configMaker.create_config_for(dataset, files, start, length)
+
+    def file_list_in(self, dataset, maxFiles):
+        self._files = self.configMaker.file_list_in(dataset, maxFiles)
+        return self._files
+
+    def nevents_in_file(self, path):
+        if self.fileIndex.get(path) is None:
+            self.fileIndex.refresh(self._files_to_scan_with(path), processes = self.processes)
+        return self.fileIndex.nevents(path)
+
+    def _files_to_scan_with(self, path):
+        try:
+            i = self._files.index(path)
+        except ValueError:
+            return [path]
+        return self._files[i:(i + max(self.processes, 1))]
+
+##__________________________________________________________________||
+def file_stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    return st.st_size, st.st_mtime
+
+##__________________________________________________________________||
+def scan_edm_file(path):
+    load_fwlite()
+    nevents = EDMEvents([path]).size()
+    run_lumis = { }
+    for lumi in EDMLumis([path]):
+        aux = lumi.luminosityBlockAuxiliary()
+        run_lumis.setdefault(aux.run(), [ ]).append(aux.luminosityBlock())
+    return dict(nevents = nevents, runs = _to_ranges(run_lumis))
+
+def scan_npz_file(path):
+    nevents = columnar_event.nevents_in_npz(path)
+    run_lumis = { }
+    if set(('run', 'lumi')) <= set(columnar_event.attribute_names_in_npz(path)):
+        columns = columnar_event.load_npz(path, ('run', 'lumi'))
+        for run, lumi in zip(columns['run'][0].tolist(), columns['lumi'][0].tolist()):
+            run_lumis.setdefault(run, [ ]).append(lumi)
+    return dict(nevents = nevents, runs = _to_ranges(run_lumis))
+
+def _to_ranges(run_lumis):
+    return [[r, min(l), max(l)] for r, l in sorted(run_lumis.items())]
+
+##__________________________________________________________________||
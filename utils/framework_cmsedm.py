@@ -3,12 +3,14 @@ import sys
 import logging
 import collections
 
-import ROOT
+try:
+    import ROOT
+    ROOT.gROOT.SetBatch(1)
+except ImportError:
+    pass
 
 import alphatwirl
 
-ROOT.gROOT.SetBatch(1)
-
 ##__________________________________________________________________||
 import logging
 logger = logging.getLogger(__name__)
@@ -20,6 +22,13 @@ logger.addHandler(log_handler)
 ##__________________________________________________________________||
 from parallel import build_parallel
 from profile_func import profile_func
+from resource_usage import ResourceUsage, ResourceMeasuringEventLoopRunner, ResourceUsagePackingSplitter
+from columnar_event import NpzEventBuilder, NpzEventBuilderConfigMaker
+from event_range_splitter import EventRangeSplitter
+from interleaving_runner import InterleavingEventLoopRunner
+from preview import SamplingSplitter
+from telemetry import TelemetrySink, TelemetryEventLoopRunner, TimedReader
+from file_index import FileIndex, CachedEventBuilderConfigMaker, scan_edm_file, scan_npz_file
 
 ##__________________________________________________________________||
 class FrameworkCMSEDM(object):
@@ -30,6 +39,7 @@ class FrameworkCMSEDM(object):
                  quiet = False,
                  parallel_mode = 'multiprocessing',
                  htcondor_job_desc_extra = [ ],
+                 straggler_factor = None,
                  process = 8,
                  user_modules = (),
                  max_events_per_dataset = -1,
@@ -37,17 +47,39 @@ class FrameworkCMSEDM(object):
                  max_files_per_dataset = -1,
                  max_files_per_process = 1,
                  profile = False,
-                 profile_out_path = None
+                 profile_out_path = None,
+                 resource_usage_path = None,
+                 target_runtime_per_process = -1,
+                 event_builder = 'cmsedm',
+                 file_index_path = None,
+                 split_files_into_ranges = False,
+                 min_events_per_range = 1000,
+                 interleave_datasets = False,
+                 preview_fraction = None,
+                 preview_strata = 10,
+                 preview_seed = 1,
+                 telemetry = None,
+                 telemetry_interval = 30
     ):
         user_modules = set(user_modules)
         user_modules.add('framework_cmsedm')
         user_modules.add('profile_func')
+        user_modules.add('resource_usage')
+        user_modules.add('columnar_event')
+        user_modules.add('file_index')
+        user_modules.add('event_range_splitter')
+        user_modules.add('interleaving_runner')
+        user_modules.add('preview')
+        user_modules.add('telemetry')
+        user_modules.add('spilling_collector')
+        user_modules.add('parquet_table')
         self.parallel = build_parallel(
             parallel_mode = parallel_mode,
             quiet = quiet,
             processes = process,
             user_modules = user_modules,
             htcondor_job_desc_extra = htcondor_job_desc_extra,
+            straggler_factor = straggler_factor,
         )
         self.max_events_per_dataset = max_events_per_dataset
         self.max_events_per_process = max_events_per_process
@@ -55,6 +87,20 @@ class FrameworkCMSEDM(object):
         self.max_files_per_process = max_files_per_process
         self.profile = profile
         self.profile_out_path = profile_out_path
+        self.parallel_mode = parallel_mode
+        self.resource_usage = ResourceUsage(resource_usage_path) if resource_usage_path else None
+        self.target_runtime_per_process = target_runtime_per_process
+        self.event_builder = event_builder
+        self.file_index_path = file_index_path
+        self.process = process
+        self.split_files_into_ranges = split_files_into_ranges
+        self.min_events_per_range = min_events_per_range
+        self.interleave_datasets = interleave_datasets
+        self.preview_fraction = preview_fraction
+        self.preview_strata = preview_strata
+        self.preview_seed = preview_seed
+        self.telemetry = telemetry
+        self.telemetry_interval = telemetry_interval
 
     def run(self, datasets, reader_collector_pairs):
         self._begin()
@@ -69,18 +115,61 @@ class FrameworkCMSEDM(object):
         reader_top = alphatwirl.loop.ReaderComposite()
         collector_top = alphatwirl.loop.CollectorComposite(self.parallel.progressMonitor.createReporter())
         for r, c in reader_collector_pairs:
+            if self.telemetry and isinstance(c, alphatwirl.loop.NullCollector):
+                r = TimedReader(r) # scribblers
             reader_top.add(r)
             collector_top.add(c)
         eventLoopRunner = alphatwirl.loop.MPEventLoopRunner(self.parallel.communicationChannel)
-        eventBuilderConfigMaker = alphatwirl.cmsedm.EventBuilderConfigMaker()
-        datasetIntoEventBuildersSplitter = alphatwirl.loop.DatasetIntoEventBuildersSplitter(
-            EventBuilder = alphatwirl.cmsedm.CMSEDMEventBuilder,
+        if self.telemetry:
+            eventLoopRunner = TelemetryEventLoopRunner(
+                eventLoopRunner,
+                sink = TelemetrySink(self.telemetry),
+                dropbox = getattr(self.parallel.communicationChannel, 'dropbox', None),
+                interval = self.telemetry_interval
+            )
+        EventBuilder, eventBuilderConfigMaker = build_event_builder(self.event_builder)
+        if self.file_index_path:
+            eventBuilderConfigMaker = self._build_cached_config_maker(eventBuilderConfigMaker)
+        splitter_kwargs = dict(
+            EventBuilder = EventBuilder,
             eventBuilderConfigMaker = eventBuilderConfigMaker,
             maxEvents = self.max_events_per_dataset,
             maxEventsPerRun = self.max_events_per_process,
             maxFiles = self.max_files_per_dataset,
             maxFilesPerRun = self.max_files_per_process
         )
+        if self.resource_usage is not None:
+            eventLoopRunner = ResourceMeasuringEventLoopRunner(
+                eventLoopRunner, self.resource_usage,
+                neventsInFile = eventBuilderConfigMaker.nevents_in_file,
+                # each task runs in a new process only in these modes
+                measureMemory = self.parallel_mode in ('subprocess', 'htcondor')
+            )
+        if self.interleave_datasets:
+            eventLoopRunner = InterleavingEventLoopRunner(eventLoopRunner, window = max(self.process, 1))
+        if self.split_files_into_ranges:
+            if self.resource_usage is not None and self.target_runtime_per_process > 0:
+                logger.warning('the files are split into event ranges. the target runtime per process is not used')
+            datasetIntoEventBuildersSplitter = EventRangeSplitter(
+                nRanges = self.process,
+                minEventsPerRange = self.min_events_per_range,
+                **splitter_kwargs
+            )
+        elif self.resource_usage is not None:
+            datasetIntoEventBuildersSplitter = ResourceUsagePackingSplitter(
+                resourceUsage = self.resource_usage,
+                targetRuntime = self.target_runtime_per_process,
+                **splitter_kwargs
+            )
+        else:
+            datasetIntoEventBuildersSplitter = alphatwirl.loop.DatasetIntoEventBuildersSplitter(**splitter_kwargs)
+        if self.preview_fraction is not None:
+            datasetIntoEventBuildersSplitter = SamplingSplitter(
+                datasetIntoEventBuildersSplitter,
+                fraction = self.preview_fraction,
+                nStrata = self.preview_strata,
+                seed = self.preview_seed
+            )
         eventReader = alphatwirl.loop.EventReader(
             eventLoopRunner = eventLoopRunner,
             reader = reader_top,
@@ -90,6 +179,14 @@ class FrameworkCMSEDM(object):
         loop = DatasetLoop(datasets = datasets, reader = eventReader)
         return loop
 
+    def _build_cached_config_maker(self, eventBuilderConfigMaker):
+        scan = scan_npz_file if self.event_builder == 'npz' else scan_edm_file
+        fileIndex = FileIndex(self.file_index_path, scan = scan)
+        return CachedEventBuilderConfigMaker(
+            eventBuilderConfigMaker, fileIndex,
+            processes = max(self.process, 1)
+        )
+
     def _run(self, loop):
         if not self.profile:
             loop()
@@ -99,6 +196,22 @@ class FrameworkCMSEDM(object):
     def _end(self):
         self.parallel.end()
 
+##__________________________________________________________________||
+def build_event_builder(event_builder):
+    """return the event builder class and the config maker
+
+    Args:
+        event_builder (str): 'cmsedm' for EDM files read with FWLite or
+                             'npz' for columnar npz files written by
+                             `columnar_event.ColumnarSkimWriter`
+
+    """
+    if event_builder == 'cmsedm':
+        return alphatwirl.cmsedm.CMSEDMEventBuilder, alphatwirl.cmsedm.EventBuilderConfigMaker()
+    if event_builder == 'npz':
+        return NpzEventBuilder, NpzEventBuilderConfigMaker()
+    raise ValueError('unknown event builder: {!r}'.format(event_builder))
+
 ##__________________________________________________________________||
 class DatasetLoop(object):
 
@@ -112,6 +225,23 @@ class DatasetLoop(object):
             self.reader.read(dataset)
         return self.reader.end()
 
+##__________________________________________________________________||
+def build_datasets(dataset_names, input_files):
+    """return a list of data sets of the input files
+
+    The input files with the same data set name are in one data set so
+    that they can be split into processes together. The data sets are
+    in the order of the first appearance of the names. The input files
+    themselves are the names if `dataset_names` is empty.
+
+    """
+    if not dataset_names:
+        dataset_names = input_files
+    name_files = collections.OrderedDict()
+    for n, f in zip(dataset_names, input_files):
+        name_files.setdefault(n, [ ]).append(f)
+    return [Dataset(n, files) for n, files in name_files.items()]
+
 ##__________________________________________________________________||
 class Dataset(object):
     def __init__(self, name, files):
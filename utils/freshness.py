@@ -0,0 +1,23 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os
+
+##__________________________________________________________________||
+def all_outputs_are_newer_than_any_input(outfile_paths, infile_paths):
+    """return True if all output files exist and are newer than any input
+
+    The same check as `all_outputs_are_newer_than_any_input()` in
+    `mianRs/all_outputs_are_newer_than_any_input.R`, which the R
+    scripts use. The input files that do not exist are ignored.
+
+    """
+    outfile_paths = list(outfile_paths)
+    if not outfile_paths:
+        return False
+    if not all([os.path.exists(p) for p in outfile_paths]):
+        return False
+    infile_mtimes = [os.path.getmtime(p) for p in infile_paths if os.path.exists(p)]
+    if not infile_mtimes:
+        return True
+    return min([os.path.getmtime(p) for p in outfile_paths]) > max(infile_mtimes)
+
+##__________________________________________________________________||
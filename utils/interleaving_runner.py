@@ -0,0 +1,74 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+from speculative import task_group
+
+##__________________________________________________________________||
+class InterleavingEventLoopRunner(object):
+    """An event loop runner that interleaves event loops of data sets
+
+    This class wraps another event loop runner, e.g.,
+    `MPEventLoopRunner`. The event loops given with `run()` are sent to
+    the wrapped runner as soon as more than `window` of them are held.
+    The one sent is from the data set of which the fewest event loops
+    have been sent so far, so that the data sets whose event loops are
+    given close to each other progress together. For example, with
+    `SpeculativeTaskPackageDropbox`, each data set then has finished
+    event loops, whose runtimes are used to find stragglers, early.
+    The event loops are at most `window` behind, so the workers do not
+    wait for all data sets to be split.
+
+    This class only delays the event loops if the data sets are not
+    split into more than one event loop each. It is not used unless
+    `interleave_datasets` of `FrameworkCMSEDM` is true.
+
+    The results are returned in the order given with `run()`.
+
+    """
+    def __init__(self, runner, window = 8):
+        self.runner = runner
+        self.window = window
+        self._pending = [ ]
+        self._order = [ ]
+        self._nsent = { }
+
+    def __repr__(self):
+        return '{}(runner = {!r}, window = {!r})'.format(
+            self.__class__.__name__,
+            self.runner,
+            self.window
+        )
+
+    def begin(self):
+        self.runner.begin()
+        self._pending = [ ]
+        self._order = [ ]
+        self._nsent = { }
+
+    def run(self, eventLoop):
+        index = len(self._order) + len(self._pending)
+        self._pending.append((index, task_group(eventLoop), eventLoop))
+        while len(self._pending) > self.window:
+            self._send_one()
+
+    def end(self):
+        while self._pending:
+            self._send_one()
+        order = self._order
+        self._order = [ ]
+        results = self.runner.end()
+        if len(results) != len(order):
+            return results # the wrapped runner has logged a warning
+        ret = [None]*len(order)
+        for i, result in zip(order, results):
+            ret[i] = result
+        return ret
+
+    def _send_one(self):
+        # the first held event loop of the data set with the fewest
+        # event loops sent
+        j = min(range(len(self._pending)), key = lambda j: self._nsent.get(self._pending[j][1], 0))
+        index, group, eventLoop = self._pending.pop(j)
+        self._nsent[group] = self._nsent.get(group, 0) + 1
+        self._order.append(index)
+        self.runner.run(eventLoop)
+
+##__________________________________________________________________||
@@ -3,6 +3,8 @@ import logging
 
 import alphatwirl
 
+from speculative import SpeculativeTaskPackageDropbox, CancellableSubprocessRunner, CancellableHTCondorJobSubmitter
+
 ##__________________________________________________________________||
 class Parallel(object):
     def __init__(self, progressMonitor, communicationChannel):
@@ -25,7 +27,7 @@ class Parallel(object):
         self.communicationChannel.end()
 
 ##__________________________________________________________________||
-def build_parallel(parallel_mode, quiet = True, processes = 4, user_modules = [ ], htcondor_job_desc_extra = [ ]):
+def build_parallel(parallel_mode, quiet = True, processes = 4, user_modules = [ ], htcondor_job_desc_extra = [ ], straggler_factor = None):
 
     default_parallel_mode = 'multiprocessing'
 
@@ -34,7 +36,8 @@ def build_parallel(parallel_mode, quiet = True, processes = 4, user_modules = [
             parallel_mode = parallel_mode,
             quiet = quiet,
             user_modules = user_modules,
-            htcondor_job_desc_extra = htcondor_job_desc_extra
+            htcondor_job_desc_extra = htcondor_job_desc_extra,
+            straggler_factor = straggler_factor
         )
 
     if not parallel_mode == default_parallel_mode:
@@ -46,25 +49,36 @@ def build_parallel(parallel_mode, quiet = True, processes = 4, user_modules = [
     return build_parallel_multiprocessing(quiet = quiet, processes = processes)
 
 ##__________________________________________________________________||
-def build_parallel_dropbox(parallel_mode, quiet, user_modules, htcondor_job_desc_extra = [ ]):
+def build_parallel_dropbox(parallel_mode, quiet, user_modules, htcondor_job_desc_extra = [ ], straggler_factor = None):
     tmpdir = '_ccsp_temp'
     user_modules = set(user_modules)
     user_modules.add('parallel')
     user_modules.add('alphatwirl')
+    user_modules.add('speculative')
     alphatwirl.mkdir_p(tmpdir)
     progressMonitor = alphatwirl.progressbar.NullProgressMonitor()
+    speculative = straggler_factor is not None
     if parallel_mode == 'htcondor':
-        dispatcher = alphatwirl.concurrently.HTCondorJobSubmitter(job_desc_extra = htcondor_job_desc_extra)
+        HTCondorJobSubmitter = CancellableHTCondorJobSubmitter if speculative else alphatwirl.concurrently.HTCondorJobSubmitter
+        dispatcher = HTCondorJobSubmitter(job_desc_extra = htcondor_job_desc_extra)
     else:
-        dispatcher = alphatwirl.concurrently.SubprocessRunner()
+        SubprocessRunner = CancellableSubprocessRunner if speculative else alphatwirl.concurrently.SubprocessRunner
+        dispatcher = SubprocessRunner()
     workingArea = alphatwirl.concurrently.WorkingArea(
         dir = tmpdir,
         python_modules = list(user_modules)
     )
-    dropbox = alphatwirl.concurrently.TaskPackageDropbox(
-        workingArea = workingArea,
-        dispatcher = dispatcher
-    )
+    if speculative:
+        dropbox = SpeculativeTaskPackageDropbox(
+            workingArea = workingArea,
+            dispatcher = dispatcher,
+            straggler_factor = straggler_factor
+        )
+    else:
+        dropbox = alphatwirl.concurrently.TaskPackageDropbox(
+            workingArea = workingArea,
+            dispatcher = dispatcher
+        )
     communicationChannel = alphatwirl.concurrently.CommunicationChannel(
         dropbox = dropbox
     )
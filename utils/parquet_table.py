@@ -0,0 +1,97 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os
+import numbers
+import itertools
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+import alphatwirl
+
+##__________________________________________________________________||
+def write_parquet(header, rows, path, schema = None, chunkRows = 100000, compression = 'zstd'):
+    """write rows to a Parquet file as they are streamed
+
+    The rows are written in row groups of `chunkRows` rows so that at
+    most one row group is held in memory.
+
+    If `schema` is not given, the columns with strings in the first
+    row group are strings and the other columns are float64, because a
+    column can have only integers, e.g., `0` for `energy_th`, in the
+    first row group and floats in later ones.
+
+    The file can be read in R with `arrow::read_parquet()`, e.g., via
+    `read.tbl()` in `read_tbl.R`.
+
+    Args:
+        header (tuple): the column names
+        rows (iterable): the rows
+        path (str): the path to the output file
+        schema (pyarrow.Schema): the types of the columns
+        chunkRows (int): the number of rows in a row group
+        compression (str): the compression codec
+
+    """
+    if pyarrow is None:
+        raise ImportError('pyarrow is required to write {}'.format(path))
+
+    dirname = os.path.dirname(path)
+    if dirname: alphatwirl.mkdir_p(dirname)
+
+    header = [str(c) for c in header]
+    rows = iter(rows)
+    writer = None
+    try:
+        while True:
+            chunk = list(itertools.islice(rows, chunkRows))
+            if not chunk and writer is not None: break
+            columns = [list(c) for c in zip(*chunk)] if chunk else [[ ] for _ in header]
+            if schema is None:
+                schema = _infer_schema(header, columns)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, schema, compression = compression)
+            table = pyarrow.Table.from_arrays(
+                [pyarrow.array(c, type = f.type) for c, f in zip(columns, schema)],
+                schema = schema
+            )
+            writer.write_table(table)
+            if not chunk: break
+    finally:
+        if writer is not None:
+            writer.close()
+
+##__________________________________________________________________||
+def read_parquet(path, batchRows = 100000):
+    """return the column names and an iterator over the rows of a Parquet file
+
+    The rows are read in batches of `batchRows` rows so that at most
+    one batch is held in memory.
+
+    """
+    if pyarrow is None:
+        raise ImportError('pyarrow is required to read {}'.format(path))
+
+    parquetFile = pyarrow.parquet.ParquetFile(path)
+    header = list(parquetFile.schema_arrow.names)
+    def rows():
+        for batch in parquetFile.iter_batches(batch_size = batchRows):
+            columns = [c.to_pylist() for c in batch.columns]
+            for row in zip(*columns):
+                yield list(row)
+    return header, rows()
+
+##__________________________________________________________________||
+def _infer_schema(header, columns):
+    fields = [ ]
+    for name, column in zip(header, columns):
+        values = [v for v in column if v is not None]
+        if values and not all([isinstance(v, numbers.Number) for v in values]):
+            fields.append(pyarrow.field(name, pyarrow.string()))
+        else:
+            fields.append(pyarrow.field(name, pyarrow.float64()))
+    return pyarrow.schema(fields)
+
+##__________________________________________________________________||
@@ -0,0 +1,190 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import random
+import logging
+
+##__________________________________________________________________||
+class SamplingSplitter(object):
+    """Split data sets into event builders that sample events
+
+    This class wraps a splitter, e.g.,
+    `alphatwirl.loop.DatasetIntoEventBuildersSplitter`, and wraps each
+    of the event builders that it returns in `SampledEventBuilder`.
+    Every file and every event range of the data sets is therefore
+    sampled with the same fraction, and the number of the tasks is
+    unchanged.
+
+    The event builders are wrapped even if `fraction` is 1 so that the
+    events have the weight, which is 1.
+
+    """
+    def __init__(self, splitter, fraction, nStrata = 10, seed = 1):
+        self.splitter = splitter
+        self.fraction = fraction
+        self.nStrata = nStrata
+        self.seed = seed
+
+    def __repr__(self):
+        return '{}(splitter = {!r}, fraction = {!r}, nStrata = {!r}, seed = {!r})'.format(
+            self.__class__.__name__,
+            self.splitter,
+            self.fraction,
+            self.nStrata,
+            self.seed
+        )
+
+    def __call__(self, dataset):
+        eventBuilders = self.splitter(dataset)
+        fraction = min(self.fraction, 1.0)
+        return [SampledEventBuilder(b, fraction, self.nStrata, self.seed) for b in eventBuilders]
+
+##__________________________________________________________________||
+class SampledEventBuilder(object):
+    """An event builder that samples events in strata
+
+    The events built by the wrapped event builder are divided into
+    `nStrata` strata of consecutive events. In each stratum, a block of
+    consecutive events of the size of `fraction` of the stratum is
+    sampled at a random position. The events are given the weight of
+    the size of the stratum divided by the size of the block in the
+    attribute `preview_weight` so that weighted tables estimate the
+    tables of all events.
+
+    The random positions are determined by the seed and the config of
+    the event builder so that the same events are sampled again.
+
+    """
+    def __init__(self, eventBuilder, fraction, nStrata = 10, seed = 1):
+        self.eventBuilder = eventBuilder
+        self.fraction = fraction
+        self.nStrata = nStrata
+        self.seed = seed
+        self.config = eventBuilder.config
+
+    def __repr__(self):
+        return '{}(eventBuilder = {!r}, fraction = {!r}, nStrata = {!r}, seed = {!r})'.format(
+            self.__class__.__name__,
+            self.eventBuilder,
+            self.fraction,
+            self.nStrata,
+            self.seed
+        )
+
+    def __call__(self):
+        events = self.eventBuilder()
+        rng = random.Random('{}:{}:{}:{}'.format(
+            self.seed, self.config.name, self.config.start, ','.join(self.config.inputPaths)
+        ))
+        blocks = stratified_blocks(events.nEvents, self.fraction, self.nStrata, rng)
+        return SampledEvents(events, blocks)
+
+##__________________________________________________________________||
+class SampledEvents(object):
+    """Events in blocks of other events
+
+    Only the events in the blocks are read. The wrapped events, e.g.,
+    `CMSEDMEvents`, are iterated over once for each block with their
+    `start` and `nEvents` set to the block. This object is given to
+    the readers as the event, with `iEvent` counting the sampled
+    events. The attributes that are not set to this object are looked
+    up in the wrapped events.
+
+    Args:
+        events: events with the attributes `start` and `nEvents`
+        blocks (list): a list of (start, length, weight), where start
+                       is the index in the wrapped events, in the
+                       order of start
+
+    """
+    def __init__(self, events, blocks):
+        self.events = events
+        self.blocks = blocks
+        self.nEvents = sum([l for _, l, _ in blocks])
+        self.iEvent = -1
+        self.preview_weight = [ ]
+
+    def __repr__(self):
+        return '{}(events = {!r}, blocks = {!r})'.format(
+            self.__class__.__name__,
+            self.events,
+            self.blocks
+        )
+
+    def __getattr__(self, name):
+        if name in ('events', 'blocks'): # e.g., while being unpickled
+            raise AttributeError(name)
+        return getattr(self.events, name)
+
+    def __iter__(self):
+        start, nEvents = self.events.start, self.events.nEvents
+        self.iEvent = 0
+        try:
+            for block_start, length, weight in self.blocks:
+                self.preview_weight[:] = [weight]
+                self.events.start = start + block_start
+                self.events.nEvents = length
+                for _ in self.events:
+                    yield self
+                    self.iEvent += 1
+        finally:
+            self.events.start, self.events.nEvents = start, nEvents
+        self.iEvent = -1
+
+##__________________________________________________________________||
+class PreviewWeight(object):
+    """The weight of events sampled by `SampledEventBuilder`
+
+    This class can be used as `weight` in table configs.
+
+    """
+    def __repr__(self):
+        return '{}()'.format(self.__class__.__name__)
+
+    def __call__(self, event):
+        return event.preview_weight[0]
+
+##__________________________________________________________________||
+def stratified_blocks(nevents, fraction, nstrata, rng):
+    """return a list of (start, length, weight) for blocks in strata
+
+    e.g., nevents = 100, fraction = 0.1, nstrata = 2 can return
+    [(12, 5, 10.0), (73, 5, 10.0)]
+
+    """
+    nstrata = min(nstrata, nevents)
+    ret = [ ]
+    for i in range(nstrata):
+        begin = nevents*i//nstrata
+        end = nevents*(i + 1)//nstrata
+        size = end - begin
+        length = min(size, max(1, int(round(fraction*size))))
+        start = begin + rng.randint(0, size - length)
+        ret.append((start, length, float(size)/length))
+    return ret
+
+##__________________________________________________________________||
+def fraction_for_time_budget(resourceUsage, datasets, seconds, processes = None, default = 0.01):
+    """return the fraction of events that can be processed in the time
+
+    The fraction is estimated from the runtime of the files recorded in
+    the resource usage, assuming that `processes` processes are busy.
+    If `processes` is `None`, e.g., for htcondor, all files are assumed
+    to be processed at the same time, and the fraction is estimated
+    from the longest runtime. The default is returned if none of the
+    files has been measured.
+
+    """
+    runtimes = [ ]
+    if resourceUsage is not None:
+        runtimes = [resourceUsage.runtime(d.name, f) for d in datasets for f in d.files]
+        runtimes = [r for r in runtimes if r is not None]
+    if not runtimes:
+        logger = logging.getLogger(__name__)
+        logger.warning('no runtime recorded for the data sets. sampling a fraction of {}'.format(default))
+        return default
+    if processes is None:
+        return min(1.0, seconds/max(runtimes))
+    nfiles = len([f for d in datasets for f in d.files])
+    total = sum(runtimes)/len(runtimes)*nfiles # the unmeasured files are assumed to take the mean
+    return min(1.0, seconds*max(processes, 1)/total)
+
+##__________________________________________________________________||
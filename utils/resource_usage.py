@@ -0,0 +1,315 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os
+import json
+import math
+import time
+import logging
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import alphatwirl
+
+##__________________________________________________________________||
+class ResourceUsage(object):
+    """Runtime and peak memory measured for each file in data sets
+
+    The measurements are stored in a JSON file keyed by the data set
+    name and the file path so that they can be used in later runs to
+    size the memory requests and to pack files into processes.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.usage = { }
+        self._load()
+
+    def __repr__(self):
+        return '{}(path = {!r})'.format(
+            self.__class__.__name__,
+            self.path
+        )
+
+    def _load(self):
+        if not os.path.exists(self.path): return
+        with open(self.path) as f:
+            self.usage = json.load(f)
+
+    def save(self):
+        dirname = os.path.dirname(self.path)
+        if dirname: alphatwirl.mkdir_p(dirname)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.usage, f, indent = 1, sort_keys = True)
+        os.rename(tmp, self.path)
+
+    def update(self, measurements, nevents_in_file = None):
+        """update with a list of task measurements
+
+        A task that reads more than one file shares its runtime equally
+        among the files. The runtime of a task that reads only part of
+        the files, e.g., with `-n` or in the preview mode, is scaled up
+        to the whole files by the number of events read over the
+        number of events in the files, given by `nevents_in_file(path)`.
+        Such measurements are skipped if `nevents_in_file` is not given.
+        Runtimes of tasks reading parts of the same file are summed up.
+
+        The estimate of a file replaces the recorded one only if it is
+        measured from a larger fraction of the file. The peak memory is
+        the maximum of the recorded and the new one. It is None in the
+        measurements of tasks whose memory was not measured.
+
+        """
+        file_usage = { }
+        for m in measurements:
+            files = m['files']
+            if not files: continue
+            fraction = self._measured_fraction(m, nevents_in_file)
+            if fraction is None: continue
+            for f in files:
+                key = self._key(m['dataset'], f)
+                u = file_usage.setdefault(key, dict(runtime = 0.0, fraction = 0.0, peak_memory_mb = None))
+                u['runtime'] += m['runtime']/len(files)
+                u['fraction'] += fraction
+                u['peak_memory_mb'] = _max_memory(u['peak_memory_mb'], m.get('peak_memory_mb'))
+
+        for key, u in file_usage.items():
+            if u['fraction'] <= 0: continue
+            new = dict(
+                runtime = u['runtime']/min(u['fraction'], 1.0),
+                fraction = min(u['fraction'], 1.0),
+                peak_memory_mb = u['peak_memory_mb']
+            )
+            old = self.usage.get(key)
+            if old is not None:
+                if old.get('fraction', 1.0) > new['fraction']:
+                    new['runtime'] = old['runtime']
+                    new['fraction'] = old.get('fraction', 1.0)
+                new['peak_memory_mb'] = _max_memory(new['peak_memory_mb'], old.get('peak_memory_mb'))
+            self.usage[key] = new
+
+    def _measured_fraction(self, measurement, nevents_in_file):
+        # the fraction of the events in the files read by the task
+        m = measurement
+        if m.get('start', 0) <= 0 and m.get('maxEvents', -1) < 0 and not m.get('sampled', False):
+            return 1.0
+        if m.get('nevents') is None or nevents_in_file is None:
+            return None
+        total = sum([nevents_in_file(f) for f in m['files']])
+        if total <= 0:
+            return None
+        return min(float(m['nevents'])/total, 1.0)
+
+    def runtime(self, dataset_name, path):
+        u = self.usage.get(self._key(dataset_name, path))
+        if u is None: return None
+        return u['runtime']
+
+    def peak_memory_mb(self, dataset_name, path):
+        u = self.usage.get(self._key(dataset_name, path))
+        if u is None: return None
+        return u['peak_memory_mb']
+
+    def request_memory_mb(self, datasets, default = 250, margin = 1.5):
+        """return memory to request for processes reading the data sets
+
+        The largest peak memory measured for the files in the data sets
+        times the margin. The default is returned if none of the files
+        has been measured.
+
+        """
+        peaks = [self.peak_memory_mb(d.name, f) for d in datasets for f in d.files]
+        peaks = [p for p in peaks if p is not None]
+        if not peaks: return default
+        return int(math.ceil(max(peaks)*margin))
+
+    def _key(self, dataset_name, path):
+        return '{}:{}'.format(dataset_name, path)
+
+##__________________________________________________________________||
+class MeasuredEventLoop(object):
+    """An event loop that measures its runtime and peak memory
+
+    This class is sent to workers in place of the event loop. It
+    returns a pair of the result of the event loop and a dict of the
+    measurements.
+
+    The peak memory is the maximum resident set size of the worker
+    process. It is measured only if `measureMemory` is true, which
+    should be the case only in the subprocess and htcondor modes, in
+    which each task runs in a new process. In the multiprocessing
+    mode, the maximum resident set size is the peak over all tasks
+    that the worker has run. The peak memory is None if not measured.
+
+    """
+    def __init__(self, eventLoop, measureMemory = True):
+        self.eventLoop = eventLoop
+        self.measureMemory = measureMemory
+
+    def __repr__(self):
+        return '{}(eventLoop = {!r}, measureMemory = {!r})'.format(
+            self.__class__.__name__,
+            self.eventLoop,
+            self.measureMemory
+        )
+
+    def __call__(self, progressReporter = None):
+        counter = EventCountingProgressReporter(progressReporter)
+        time_start = time.time()
+        result = self.eventLoop(counter)
+        runtime = time.time() - time_start
+        config = self.eventLoop.build_events.config
+        measurement = dict(
+            dataset = config.name,
+            files = list(config.inputPaths),
+            start = config.start,
+            maxEvents = config.maxEvents,
+            sampled = getattr(self.eventLoop.build_events, 'fraction', 1.0) < 1, # preview.SampledEventBuilder
+            nevents = counter.nevents,
+            runtime = runtime,
+            peak_memory_mb = peak_memory_mb() if self.measureMemory else None,
+        )
+        return result, measurement
+
+##__________________________________________________________________||
+class EventCountingProgressReporter(object):
+    """A progress reporter that counts the events of an event loop
+
+    The number of events is `done` of the last report, i.e., the
+    number of events that the event loop has started. The reports are
+    passed to another progress reporter if given.
+
+    The function given with `every()` is called with the number of
+    events at most once every `interval` seconds, e.g., to emit the
+    throughput in `telemetry.TelemetryEventLoop`.
+
+    """
+    def __init__(self, progressReporter = None):
+        self.progressReporter = progressReporter
+        self.nevents = 0
+        self.interval = None
+        self.func = None
+
+    def __repr__(self):
+        return '{}(progressReporter = {!r})'.format(
+            self.__class__.__name__,
+            self.progressReporter
+        )
+
+    def every(self, interval, func):
+        self.interval = interval
+        self.func = func
+        self._last = time.time()
+
+    def report(self, report):
+        self.nevents = report.done
+        if self.func is not None:
+            now = time.time()
+            if now - self._last >= self.interval:
+                self._last = now
+                self.func(self.nevents)
+        if self.progressReporter is not None:
+            self.progressReporter.report(report)
+
+##__________________________________________________________________||
+class ResourceMeasuringEventLoopRunner(object):
+    """An event loop runner that records measurements of event loops
+
+    This class wraps another event loop runner, e.g.,
+    `MPEventLoopRunner`. Event loops are sent as `MeasuredEventLoop`.
+    The measurements are stripped from the results and saved in the
+    resource usage.
+
+    `neventsInFile`, e.g., `nevents_in_file` of the event builder
+    config maker, is used to scale the runtimes of the tasks that read
+    part of the files. It is only called for such tasks.
+
+    `measureMemory` is given to `MeasuredEventLoop`.
+
+    """
+    def __init__(self, runner, resourceUsage, neventsInFile = None, measureMemory = True):
+        self.runner = runner
+        self.resourceUsage = resourceUsage
+        self.neventsInFile = neventsInFile
+        self.measureMemory = measureMemory
+
+    def __repr__(self):
+        return '{}(runner = {!r}, resourceUsage = {!r}, neventsInFile = {!r}, measureMemory = {!r})'.format(
+            self.__class__.__name__,
+            self.runner,
+            self.resourceUsage,
+            self.neventsInFile,
+            self.measureMemory
+        )
+
+    def begin(self):
+        self.runner.begin()
+
+    def run(self, eventLoop):
+        self.runner.run(MeasuredEventLoop(eventLoop, measureMemory = self.measureMemory))
+
+    def end(self):
+        results = self.runner.end()
+        # None for a task that failed
+        measurements = [r[1] for r in results if r is not None]
+        self.resourceUsage.update(measurements, nevents_in_file = self.neventsInFile)
+        self.resourceUsage.save()
+        return [r[0] if r is not None else None for r in results]
+
+##__________________________________________________________________||
+class ResourceUsagePackingSplitter(alphatwirl.loop.DatasetIntoEventBuildersSplitter):
+    """Split data sets into processes of about the same measured runtime
+
+    Consecutive files are packed into a process until the sum of the
+    measured runtimes reaches the target. This class falls back to
+    the base class if the number of events is limited or if any of
+    the files has not been measured.
+
+    """
+    def __init__(self, resourceUsage, targetRuntime, **kwargs):
+        super(ResourceUsagePackingSplitter, self).__init__(**kwargs)
+        self.resourceUsage = resourceUsage
+        self.targetRuntime = targetRuntime
+
+    def _file_start_length_list(self, dataset, maxEvents = -1, maxEventsPerRun = -1,
+                                maxFiles = -1, maxFilesPerRun = 1):
+        base = super(ResourceUsagePackingSplitter, self)._file_start_length_list
+        if self.targetRuntime <= 0 or maxEvents >= 0 or maxEventsPerRun >= 0:
+            return base(dataset, maxEvents, maxEventsPerRun, maxFiles, maxFilesPerRun)
+
+        files = self.eventBuilderConfigMaker.file_list_in(dataset, maxFiles = maxFiles)
+        runtimes = [self.resourceUsage.runtime(dataset.name, f) for f in files]
+        if None in runtimes:
+            return base(dataset, maxEvents, maxEventsPerRun, maxFiles, maxFilesPerRun)
+
+        ret = [ ]
+        packed = [ ]
+        packed_runtime = 0.0
+        for f, runtime in zip(files, runtimes):
+            if packed and packed_runtime + runtime > self.targetRuntime:
+                ret.append((packed, 0, -1))
+                packed = [ ]
+                packed_runtime = 0.0
+            packed.append(f)
+            packed_runtime += runtime
+        if packed:
+            ret.append((packed, 0, -1))
+
+        logger = logging.getLogger(__name__)
+        logger.info('{}: {} files packed into {} processes'.format(dataset.name, len(files), len(ret)))
+        return ret
+
+##__________________________________________________________________||
+def _max_memory(a, b):
+    # the larger of two peak memories, either of which can be None
+    if a is None: return b
+    if b is None: return a
+    return max(a, b)
+
+def peak_memory_mb():
+    if resource is None: return 0.0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024.0 # KB on Linux
+
+##__________________________________________________________________||
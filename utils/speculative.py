@@ -0,0 +1,268 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os
+import time
+import gzip
+import shutil
+import logging
+import subprocess
+from operator import itemgetter
+
+try:
+    import cPickle as pickle
+except:
+    import pickle
+
+import alphatwirl
+
+##__________________________________________________________________||
+class SpeculativeTaskPackageDropbox(object):
+    """A drop box for task packages that re-executes stragglers
+
+    This class works in the same way as `TaskPackageDropbox` except
+    that it launches a duplicate of a task package whose runtime
+    exceeds `straggler_factor` times the median runtime of finished
+    task packages of the same group. The result of whichever copy
+    finishes first is used. The other copies are cancelled.
+
+    The dispatcher needs to have the method `cancel(runids)`, e.g.,
+    `CancellableSubprocessRunner` or `CancellableHTCondorJobSubmitter`.
+
+    Each copy of a task package is run from its own copy of the package
+    file, e.g., `task_00009_1.p.gz`, so that it writes its result and
+    the htcondor outputs in its own directory, e.g.,
+    `results/task_00009_1/`. The result is collected only from the
+    copy that finished. A cancelled copy cannot overwrite it.
+
+    Task packages are grouped by the data set names of the event
+    loops. The median of all finished task packages is used for a
+    group with fewer than `min_finished` finished task packages.
+
+    """
+    def __init__(self, workingArea, dispatcher, sleep = 5,
+                 straggler_factor = 3.0, min_finished = 5, max_copies = 2):
+        self.workingArea = workingArea
+        self.dispatcher = dispatcher
+        self.sleep = sleep
+        self.straggler_factor = straggler_factor
+        self.min_finished = min_finished
+        self.max_copies = max_copies
+
+    def __repr__(self):
+        name_value_pairs = (
+            ('workingArea',      self.workingArea),
+            ('dispatcher',       self.dispatcher),
+            ('sleep',            self.sleep),
+            ('straggler_factor', self.straggler_factor),
+            ('min_finished',     self.min_finished),
+            ('max_copies',       self.max_copies),
+        )
+        return '{}({})'.format(
+            self.__class__.__name__,
+            ', '.join(['{} = {!r}'.format(n, v) for n, v in name_value_pairs]),
+        )
+
+    def open(self):
+        self.workingArea.open()
+        self.runid_package_index_map = { }
+        self.runid_start_time = { }
+        self.runid_package_path = { }
+        self.package_index_ncopies = { }
+        self.package_index_runids = { }
+        self.package_index_group = { }
+        self.group_runtimes = { }
+
+    def put(self, package):
+        package_index = self.workingArea.put_package(package)
+        self.package_index_group[package_index] = task_group(package.task)
+        self._run(package_index)
+        return package_index
+
+    def receive(self):
+        pkgidx_result_pairs = [ ] # a list of (package_index, _result)
+        try:
+            while self.package_index_runids:
+
+                for runid in self.dispatcher.poll():
+                    pair = self._finished(runid)
+                    if pair is not None:
+                        pkgidx_result_pairs.append(pair)
+
+                self._launch_duplicates_of_stragglers()
+
+                time.sleep(self.sleep)
+
+        except KeyboardInterrupt:
+            logger = logging.getLogger(__name__)
+            logger.warning('received KeyboardInterrupt')
+            self.dispatcher.terminate()
+
+        # sort in the order of package_index
+        pkgidx_result_pairs = sorted(pkgidx_result_pairs, key = itemgetter(0))
+
+        results = [result for i, result in pkgidx_result_pairs]
+        return results
+
+    def close(self):
+        self.dispatcher.terminate()
+        self.workingArea.close()
+
+    def _run(self, package_index):
+        copy = self.package_index_ncopies.get(package_index, 0)
+        self.package_index_ncopies[package_index] = copy + 1
+        workingArea = _CopyWorkingArea(self.workingArea, copy)
+        workingArea.put_copy(package_index)
+        runid = self.dispatcher.run(workingArea, package_index)
+        self.runid_package_index_map[runid] = package_index
+        self.runid_start_time[runid] = time.time()
+        self.runid_package_path[runid] = workingArea.package_path(package_index)
+        self.package_index_runids.setdefault(package_index, [ ]).append(runid)
+
+    def _finished(self, runid):
+        # returns (package_index, result) if the package is done
+
+        package_index = self.runid_package_index_map.pop(runid, None)
+        if package_index is None:
+            return None # a cancelled copy
+
+        start_time = self.runid_start_time.pop(runid)
+        package_path = self.runid_package_path.pop(runid)
+        runids = self.package_index_runids[package_index]
+        runids.remove(runid)
+
+        result = collect_result(self.workingArea.path, package_path)
+
+        if result is None:
+            self.dispatcher.failed_runids([runid])
+            if runids:
+                return None # another copy is still running
+            logger = logging.getLogger(__name__)
+            logger.warning('resubmitting {}'.format(self.workingArea.package_path(package_index)))
+            self._run(package_index)
+            return None
+
+        del self.package_index_runids[package_index]
+        group = self.package_index_group.pop(package_index)
+        self.group_runtimes.setdefault(group, [ ]).append(time.time() - start_time)
+
+        if runids:
+            logger = logging.getLogger(__name__)
+            logger.info('cancelling {} duplicate(s) of {}'.format(len(runids), self.workingArea.package_path(package_index)))
+            self.dispatcher.cancel(runids)
+            for i in runids:
+                del self.runid_package_index_map[i]
+                del self.runid_start_time[i]
+                del self.runid_package_path[i]
+
+        return package_index, result
+
+    def _launch_duplicates_of_stragglers(self):
+        now = time.time()
+        for package_index, runids in self.package_index_runids.items():
+            if len(runids) >= self.max_copies: continue
+            median = self._median_runtime(self.package_index_group[package_index])
+            if median is None: continue
+            elapsed = now - min([self.runid_start_time[i] for i in runids])
+            if elapsed <= self.straggler_factor*median: continue
+            logger = logging.getLogger(__name__)
+            logger.info('launching a duplicate of {}: running for {:.0f} s, median {:.0f} s'.format(
+                self.workingArea.package_path(package_index), elapsed, median))
+            self._run(package_index)
+
+    def _median_runtime(self, group):
+        runtimes = self.group_runtimes.get(group, [ ])
+        if len(runtimes) < self.min_finished:
+            runtimes = [r for rr in self.group_runtimes.values() for r in rr]
+        if len(runtimes) < self.min_finished:
+            return None
+        runtimes = sorted(runtimes)
+        n = len(runtimes)
+        if n % 2:
+            return runtimes[n//2]
+        return (runtimes[n//2 - 1] + runtimes[n//2])/2.0
+
+##__________________________________________________________________||
+class _CopyWorkingArea(object):
+    # the working area as seen by the dispatcher for a copy of task
+    # packages. the dispatchers run the package at package_path() and
+    # the result is stored in the directory named after it. the first
+    # copy is the package file itself
+
+    def __init__(self, workingArea, copy):
+        self.workingArea = workingArea
+        self.copy = copy
+
+    def __getattr__(self, name):
+        # anything else, e.g., path, from the working area
+        if name in ('workingArea', 'copy'):
+            raise AttributeError(name)
+        return getattr(self.workingArea, name)
+
+    def package_path(self, package_index):
+        path = self.workingArea.package_path(package_index)
+        if self.copy == 0: return path
+        # e.g., 'task_00009.p.gz' -> 'task_00009_1.p.gz'
+        base, ext = path.split('.', 1)
+        return '{}_{}.{}'.format(base, self.copy, ext)
+
+    def put_copy(self, package_index):
+        if self.copy == 0: return
+        src = os.path.join(self.path, self.workingArea.package_path(package_index))
+        shutil.copy(src, os.path.join(self.path, self.package_path(package_index)))
+
+    def collect_result(self, package_index):
+        return collect_result(self.path, self.package_path(package_index))
+
+def collect_result(taskdir, package_path):
+    """return the result of the task package or None
+
+    The same as `WorkingArea.collect_result()` except that the result
+    is looked up from the package path, e.g., `task_00009_1.p.gz`, as
+    `run.py` stores it.
+
+    """
+    dirname = package_path.split('.', 1)[0]
+    result_path = os.path.join(taskdir, 'results', dirname, 'result.p.gz')
+    try:
+        f = gzip.open(result_path, 'rb')
+        result = pickle.load(f)
+    except (IOError, EOFError) as e:
+        logger = logging.getLogger(__name__)
+        logger.warning(e)
+        return None
+    return result
+
+##__________________________________________________________________||
+class CancellableSubprocessRunner(alphatwirl.concurrently.SubprocessRunner):
+    """`SubprocessRunner` that can terminate particular processes
+    """
+    def cancel(self, runids):
+        procs = [p for p in self.running_procs if p.pid in runids]
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+        self.running_procs = [p for p in self.running_procs if p not in procs]
+
+##__________________________________________________________________||
+class CancellableHTCondorJobSubmitter(alphatwirl.concurrently.HTCondorJobSubmitter):
+    """`HTCondorJobSubmitter` that can remove particular jobs
+    """
+    def cancel(self, runids):
+        runids = [i for i in runids if i in self.clusterids_outstanding]
+        if not runids: return
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(['condor_rm'] + runids, stdout = devnull)
+        self.clusterids_outstanding[:] = [i for i in self.clusterids_outstanding if i not in runids]
+
+##__________________________________________________________________||
+def task_group(task):
+    # the data set name of the event loop, which can be wrapped, e.g.,
+    # in MeasuredEventLoop
+    while task is not None:
+        build_events = getattr(task, 'build_events', None)
+        if build_events is not None:
+            config = getattr(build_events, 'config', None)
+            return getattr(config, 'name', None)
+        task = getattr(task, 'eventLoop', None)
+    return None
+
+##__________________________________________________________________||
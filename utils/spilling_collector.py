@@ -0,0 +1,300 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os
+import heapq
+import shutil
+import tempfile
+import itertools
+import logging
+
+try:
+   import cPickle as pickle
+except:
+   import pickle
+
+import alphatwirl
+
+from parquet_table import write_parquet
+
+##__________________________________________________________________||
+# the maximum number of run files read at the same time in the merge
+MAX_OPEN_RUNS = 200
+
+##__________________________________________________________________||
+class SpillingCollector(object):
+    """A collector that merges partial tables on disk
+
+    This class can be used in place of `Collector` with
+    `ToTupleListWithDatasetColumn` and `WriteListToFile`. Instead of
+    combining the results of all readers in memory, this class
+    converts the result of one reader at a time into rows, which are
+    buffered in memory. When the buffer exceeds `maxRowsInMemory`
+    rows, the buffer is sorted and spilled to a run file on disk. At
+    the end, the runs are merged with a k-way merge, in which the
+    values of rows with the same key are summed up if `sumValues` is
+    true, and the rows are streamed into the output file with
+    `writeTable`.
+
+    The readers can be `SpillingReader`, which have written their
+    rows into run files in the workers. Such runs are merged as they
+    are, and the results are never held in memory in the driver. The
+    run files are removed after the merge.
+
+    Args:
+        resultsCombinationMethod: e.g., `ToTupleListWithDatasetColumn`
+        outPath (str): the path to the output file
+        nKeyColumns (int): the number of the key columns including the
+                           data set column
+        sumValues (bool): False for e.g. `Scan`, whose rows with the
+                          same key are all kept
+        maxRowsInMemory (int): the size of the buffer in rows
+        tmpDir (str): the directory in which run files are created
+        writeTable: a function to write the rows, e.g.,
+                    `write_aligned_text()` or `write_parquet()`
+
+    """
+    def __init__(self, resultsCombinationMethod, outPath, nKeyColumns,
+                 sumValues = True, maxRowsInMemory = 1000000, tmpDir = None,
+                 writeTable = None):
+        self.resultsCombinationMethod = resultsCombinationMethod
+        self.outPath = outPath
+        self.nKeyColumns = nKeyColumns
+        self.sumValues = sumValues
+        self.maxRowsInMemory = maxRowsInMemory
+        self.tmpDir = tmpDir
+        self.writeTable = writeTable if writeTable is not None else write_aligned_text
+
+    def __repr__(self):
+        name_value_pairs = (
+            ('resultsCombinationMethod', self.resultsCombinationMethod),
+            ('outPath',                  self.outPath),
+            ('nKeyColumns',              self.nKeyColumns),
+            ('sumValues',                self.sumValues),
+            ('maxRowsInMemory',          self.maxRowsInMemory),
+            ('tmpDir',                   self.tmpDir),
+            ('writeTable',               self.writeTable),
+        )
+        return '{}({})'.format(
+            self.__class__.__name__,
+            ', '.join(['{} = {!r}'.format(n, v) for n, v in name_value_pairs]),
+        )
+
+    def collect(self, dataset_readers_list):
+        if self.tmpDir is not None:
+            alphatwirl.mkdir_p(self.tmpDir)
+        workdir = tempfile.mkdtemp(prefix = 'spill_', dir = self.tmpDir)
+        worker_run_paths = [r.runPath for _, readers in dataset_readers_list
+                            for r in readers if isinstance(r, SpillingReader) and r.runPath is not None]
+        try:
+            header, runs, buffer_ = self._spill_into_runs(dataset_readers_list, workdir)
+            if header is None: return None
+            runs = self._reduce_open_runs(runs, workdir)
+            runs.append(iter(sorted(buffer_)))
+            del buffer_
+            rows = self._merge(runs)
+            self.writeTable(header, rows, self.outPath)
+        finally:
+            shutil.rmtree(workdir)
+            for p in worker_run_paths:
+                if os.path.exists(p): os.remove(p)
+        return self.outPath
+
+    def _spill_into_runs(self, dataset_readers_list, workdir):
+
+        # each entry in the buffer and in the runs is (sort_key, serial, row).
+        # sort_key is (dataset_index, ) + key columns of the row. serial,
+        # (reader_index, row_index), keeps the order of rows with the
+        # same key and prevents rows from being compared.
+
+        header = None
+        runs = [ ]
+        buffer_ = [ ]
+        reader_index = itertools.count()
+        for dataset_index, (dataset, readers) in enumerate(dataset_readers_list):
+            for reader in readers:
+                i = next(reader_index)
+                if isinstance(reader, SpillingReader):
+                    if reader.runPath is None: continue
+                    header = reader.header
+                    runs.append(_index_run(reader.runPath, dataset_index, i))
+                    continue
+                rows = self.resultsCombinationMethod.combine([(dataset, (reader, ))])
+                if rows is None: continue
+                header = rows[0]
+                buffer_.extend([((dataset_index, ) + r[:self.nKeyColumns], (i, j), r) for j, r in enumerate(rows[1:])])
+                del rows
+                if len(buffer_) >= self.maxRowsInMemory:
+                    runs.append(read_run(write_run(sorted(buffer_), workdir)))
+                    buffer_ = [ ]
+
+        if runs:
+            logger = logging.getLogger(__name__)
+            logger.info('{}: merging {} runs spilled to disk'.format(self.outPath, len(runs)))
+
+        return header, runs, buffer_
+
+    def _reduce_open_runs(self, runs, workdir):
+        # merge the runs into fewer runs so that at most MAX_OPEN_RUNS
+        # files are open at the same time in the final merge
+        while len(runs) > MAX_OPEN_RUNS:
+            runs = [read_run(write_run(heapq.merge(*runs[i:(i + MAX_OPEN_RUNS)]), workdir))
+                    for i in range(0, len(runs), MAX_OPEN_RUNS)]
+        return runs
+
+    def _merge(self, runs):
+        merged = heapq.merge(*runs)
+        if not self.sumValues:
+            for _, _, row in merged:
+                yield row
+            return
+        for _, entries in itertools.groupby(merged, key = lambda e: e[0]):
+            rows = [e[2] for e in entries]
+            if len(rows) == 1:
+                yield rows[0]
+                continue
+            vals = [sum(v) for v in zip(*[r[self.nKeyColumns:] for r in rows])]
+            yield rows[0][:self.nKeyColumns] + tuple(vals)
+
+def _index_run(path, dataset_index, reader_index):
+    # the entries of a run written by SpillingReader, (key, row_index,
+    # row), as the entries of SpillingCollector
+    for key, j, row in read_run(path):
+        yield (dataset_index, ) + key, (reader_index, j), row
+
+##__________________________________________________________________||
+class SpillingReader(object):
+    """A reader that writes the results of another reader into a run file
+
+    This class wraps a reader in the workers. At the end, the results
+    of the wrapped reader are converted into rows with
+    `resultsCombinationMethod`, sorted, and written into a run file in
+    `spillDir`, which `SpillingCollector` merges. The wrapped reader is
+    then dropped so that only the path to the run file is returned to
+    the driver.
+
+    `spillDir` needs to be an absolute path on a file system that the
+    driver can read, which is not the case in the htcondor mode unless
+    it is shared with the worker nodes.
+
+    """
+    def __init__(self, reader, resultsCombinationMethod, nKeyColumns, spillDir):
+        self.reader = reader
+        self.resultsCombinationMethod = resultsCombinationMethod
+        self.nKeyColumns = nKeyColumns
+        self.spillDir = spillDir
+        self.header = None
+        self.runPath = None
+
+    def __repr__(self):
+        return '{}(reader = {!r}, resultsCombinationMethod = {!r}, nKeyColumns = {!r}, spillDir = {!r})'.format(
+            self.__class__.__name__,
+            self.reader,
+            self.resultsCombinationMethod,
+            self.nKeyColumns,
+            self.spillDir
+        )
+
+    def begin(self, event):
+        self.dataset = event.dataset
+        self.reader.begin(event)
+
+    def event(self, event):
+        return self.reader.event(event)
+
+    def end(self):
+        self.reader.end()
+        rows = self.resultsCombinationMethod.combine([(self.dataset, (self.reader, ))])
+        self.reader = None
+        if rows is None: return
+        self.header = rows[0]
+        entries = sorted([(r[:self.nKeyColumns], j, r) for j, r in enumerate(rows[1:])])
+        del rows
+        alphatwirl.mkdir_p(self.spillDir)
+        self.runPath = write_run(entries, self.spillDir)
+
+##__________________________________________________________________||
+def build_counter_spilling_collector_pair(tblcfg, maxRowsInMemory = 1000000, tmpDir = None,
+                                          spillInWorkers = False):
+    """build a pair of a reader and a `SpillingCollector`
+
+    The reader is the same as the one built by
+    `alphatwirl.configure.build_counter_collector_pair()`, wrapped in
+    `SpillingReader` if `spillInWorkers` is true so that the workers
+    write the rows into run files in `tmpDir`. The table is written in
+    Parquet if the path of the output file ends with `.parquet` and in
+    aligned text otherwise.
+
+    """
+    reader, collector = alphatwirl.configure.build_counter_collector_pair(tblcfg)
+    if not tblcfg['outFile']:
+        return reader, collector
+    nKeyColumns = 1 + len(tblcfg['keyOutColumnNames']) # 1 for the data set column
+    if spillInWorkers:
+        reader = SpillingReader(
+            reader,
+            resultsCombinationMethod = collector.resultsCombinationMethod,
+            nKeyColumns = nKeyColumns,
+            spillDir = os.path.abspath(tmpDir if tmpDir is not None else tempfile.gettempdir())
+        )
+    collector = SpillingCollector(
+        resultsCombinationMethod = collector.resultsCombinationMethod,
+        outPath = tblcfg['outFilePath'],
+        nKeyColumns = nKeyColumns,
+        sumValues = tblcfg['summaryClass'] is not alphatwirl.summary.Scan,
+        maxRowsInMemory = maxRowsInMemory,
+        tmpDir = tmpDir,
+        writeTable = write_parquet if tblcfg['outFilePath'].endswith('.parquet') else write_aligned_text
+    )
+    return reader, collector
+
+##__________________________________________________________________||
+def write_run(entries, dirname):
+    fd, path = tempfile.mkstemp(suffix = '.p', dir = dirname)
+    with os.fdopen(fd, 'wb') as f:
+        pickler = pickle.Pickler(f, protocol = pickle.HIGHEST_PROTOCOL)
+        for e in entries:
+            pickler.dump(e)
+            pickler.clear_memo()
+    return path
+
+def read_run(path):
+    with open(path, 'rb') as f:
+        unpickler = pickle.Unpickler(f)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                return
+
+##__________________________________________________________________||
+def write_aligned_text(header, rows, path):
+    """write rows in the same format as `alphatwirl.listToAlignedText`
+
+    The rows are read only once. They are converted to strings and
+    written to a temporary file next to the output file while the
+    column widths are measured. The aligned text is then written from
+    the temporary file.
+
+    """
+    dirname = os.path.dirname(path)
+    if dirname: alphatwirl.mkdir_p(dirname)
+    widths = [len(e) for e in _to_strings(header)]
+    tmp = write_run(_measure_widths(rows, widths), dirname if dirname else None)
+
+    format_ = ' ' + ' '.join(['{:>' + str(w) + 's}' for w in widths]) + '\n'
+    with open(path, 'w') as f:
+        f.write(format_.format(*_to_strings(header)))
+        for row in read_run(tmp):
+            f.write(format_.format(*row))
+    os.remove(tmp)
+
+def _measure_widths(rows, widths):
+    for row in rows:
+        row = _to_strings(row)
+        widths[:] = [max(w, len(e)) for w, e in zip(widths, row)]
+        yield row
+
+def _to_strings(row):
+    row = [int(e) if isinstance(e, float) and e.is_integer() else e for e in row]
+    return [alphatwirl.quote_string(str(e)) for e in row]
+
+##__________________________________________________________________||
@@ -0,0 +1,167 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os
+import math
+import random
+
+##__________________________________________________________________||
+class SyntheticEvents(object):
+    """Synthetic single-particle gun events that mimic `CMSEDMEvents`
+
+    Each event has a few generator-level particles in the HF
+    acceptance, a MET, and HF pre-rec hits in all channels listed in
+    `tbl/tbl_HF_ieta_iphi_eta_phi.txt`. The energy in each channel is
+    the shower of the particles, shared between the depths, on top of
+    noise. The attribute `edm_event` provides the same interface to
+    the scribblers as FWLite, i.e., `getByLabel()` with a `Handle` and
+    `eventAuxiliary()`.
+
+    The events are generated while iterating. The same seed gives the
+    same events.
+
+    """
+    def __init__(self, nEvents, seed = 1, tbl_path = None, ngen = 1):
+        if tbl_path is None:
+            this_dir = os.path.dirname(os.path.realpath(__file__))
+            tbl_path = os.path.join(this_dir, '..', 'tbl', 'tbl_HF_ieta_iphi_eta_phi.txt')
+        self.nEvents = nEvents
+        self.seed = seed
+        self.ngen = ngen
+        self.channels = read_hf_channels(tbl_path)
+        self.edm_event = SyntheticEDMEvent()
+        self.iEvent = -1
+
+    def __repr__(self):
+        return '{}(nEvents = {!r}, seed = {!r}, ngen = {!r}, iEvent = {!r})'.format(
+            self.__class__.__name__,
+            self.nEvents,
+            self.seed,
+            self.ngen,
+            self.iEvent
+        )
+
+    def __iter__(self):
+        rng = random.Random(self.seed)
+        for self.iEvent in range(self.nEvents):
+            self.edm_event.set(*generate_event(rng, self.channels, self.iEvent, self.ngen))
+            yield self
+        self.iEvent = -1
+
+##__________________________________________________________________||
+class SyntheticEDMEvent(object):
+    def set(self, aux, products):
+        self._aux = aux
+        self._products = products
+
+    def eventAuxiliary(self):
+        return self._aux
+
+    def getByLabel(self, label, handle):
+        handle._product = self._products[label]
+        return True
+
+##__________________________________________________________________||
+class Handle(object):
+    """A replacement of `DataFormats.FWLite.Handle`
+    """
+    def __init__(self, typename):
+        self.typename = typename
+        self._product = None
+
+    def product(self):
+        return self._product
+
+##__________________________________________________________________||
+class _Getters(object):
+    # an object whose attributes are returned by methods of the same
+    # names as the attributes, e.g., o.eta() returns o._eta
+    __slots__ = ('_vals', )
+    def __init__(self, **kwargs):
+        self._vals = kwargs
+    def __getattr__(self, name):
+        try:
+            val = self._vals[name]
+        except KeyError:
+            raise AttributeError(name)
+        return lambda: val
+
+class EventAuxiliary(_Getters): pass
+class MET(_Getters): pass
+class GenParticle(_Getters): pass
+class HcalDetId(_Getters): pass
+class HFQIE10Info(_Getters): pass
+
+class HFPreRecHit(object):
+    __slots__ = ('_id', '_infos')
+    def __init__(self, id_, infos):
+        self._id = id_
+        self._infos = infos
+    def id(self):
+        return self._id
+    def getHFQIE10Info(self, i):
+        return self._infos[i]
+
+class Collection(list):
+    def size(self):
+        return len(self)
+    def front(self):
+        return self[0]
+
+##__________________________________________________________________||
+def read_hf_channels(path):
+    # returns a list of (ieta, iphi, depth, eta, phi)
+    ret = [ ]
+    with open(path) as f:
+        header = f.readline().split()
+        for line in f:
+            row = dict(zip(header, line.split()))
+            ret.append((
+                int(row['ieta']), int(row['iphi']), int(row['hfdepth']),
+                float(row['eta']), float(row['phi'])
+            ))
+    return ret
+
+##__________________________________________________________________||
+def generate_event(rng, channels, ievent, ngen):
+    aux = EventAuxiliary(run = 1, luminosityBlock = 1 + ievent//100, event = 1 + ievent)
+
+    gens = Collection()
+    for _ in range(ngen):
+        pdgId = rng.choice((11, -11, 211, -211))
+        eta = rng.choice((-1, 1))*rng.uniform(3.0, 4.8)
+        phi = rng.uniform(-math.pi, math.pi)
+        energy = rng.choice((30, 50, 70, 100, 150, 300))
+        gens.append(GenParticle(pdgId = pdgId, eta = eta, phi = phi, energy = energy))
+
+    met = Collection([MET(pt = rng.expovariate(1/20.0))])
+
+    hits = Collection()
+    for ieta, iphi, depth, eta, phi in channels:
+        infos = [ ]
+        for _ in (0, 1):
+            energy = rng.gauss(0, 0.8)
+            for g in gens:
+                deta = eta - g.eta()
+                dphi = math.acos(math.cos(phi - g.phi()))
+                dr2 = deta**2 + dphi**2
+                if dr2 > 0.09: continue
+                em = abs(g.pdgId()) == 11
+                fraction = (0.7 if depth == 1 else 0.3) if em else 0.5
+                energy += 0.5*g.energy()*fraction*math.exp(-dr2/(2*0.05**2))
+            infos.append(HFQIE10Info(
+                charge = 10*energy + rng.gauss(0, 2),
+                energy = energy,
+                timeRising = rng.gauss(-110, 5) if energy > 3 else -120.0,
+                timeFalling = rng.gauss(-100, 5) if energy > 3 else -120.0,
+                nRaw = rng.randint(3, 7),
+                soi = rng.randint(1, 4),
+            ))
+        hits.append(HFPreRecHit(HcalDetId(ieta = ieta, iphi = iphi, depth = depth), infos))
+
+    products = {
+        'pfMet': met,
+        'genParticles': gens,
+        'hfprereco': hits,
+    }
+    return aux, products
+
+##__________________________________________________________________||
@@ -0,0 +1,135 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os
+import collections
+
+from parquet_table import read_parquet
+from spilling_collector import write_aligned_text
+
+##__________________________________________________________________||
+def read_table(path):
+    """return the column names and an iterator over the rows of a table
+
+    The table is either in the aligned text written by `twirl.py` or,
+    if the path ends with `.parquet`, in Parquet. The rows are read as
+    they are iterated. The values in the text are not converted.
+
+    """
+    if path.endswith('.parquet'):
+        return read_parquet(path)
+    f = open(path)
+    header = f.readline().split()
+    def rows():
+        with f:
+            for line in f:
+                row = line.split()
+                if row: yield row
+    return header, rows()
+
+def table_path(dirname, tblFileName):
+    """the path to the Parquet version of the table if it exists
+
+    The same as `tbl.path()` in `read_tbl.R`.
+
+    """
+    path = os.path.join(dirname, tblFileName)
+    path_parquet = os.path.splitext(path)[0] + '.parquet'
+    if os.path.exists(path_parquet): return path_parquet
+    return path
+
+##__________________________________________________________________||
+def read_components(path):
+    """return the columns and a dict from the component to the other columns
+
+    e.g., (['src_particle', 'src_energy'], {'e030': ['e', '30'], ...})
+    for `tbl/tbl_component_src_particle_energy.txt`
+
+    """
+    header, rows = read_table(path)
+    i = header.index('component')
+    columns = header[:i] + header[i + 1:]
+    return columns, collections.OrderedDict([(r[i], r[:i] + r[i + 1:]) for r in rows])
+
+##__________________________________________________________________||
+def reduce_counts(inPath, outPath, varname, componentsPath,
+                  src_energies = None):
+    """join a table of counts with the components for plotting
+
+    The table, e.g., `tbl_n_component.gen_eta-w.txt`, is joined with
+    the table of the components. The rows of the components not in
+    `src_energies` are dropped if it is given. For each group, i.e.,
+    the same values in the columns other than `varname`, `n`, `nvar`,
+    a row with the minimum `varname` and `n = nvar = 0` is added so that
+    the step lines start at zero. The rows are sorted by the groups and
+    `varname`.
+
+    The tables of counts are binned and small. They are held in memory.
+
+    """
+    compColumns, components = read_components(componentsPath)
+    if src_energies is not None and 'src_energy' in compColumns:
+        j = compColumns.index('src_energy')
+        src_energies = set([float(e) for e in src_energies])
+        components = dict([(c, v) for c, v in components.items() if float(v[j]) in src_energies])
+
+    header, rows = read_table(inPath)
+    icomp = header.index('component')
+    ival = header.index(varname)
+    igroup = [i for i, c in enumerate(header) if c not in (varname, 'n', 'nvar')]
+
+    table = [r for r in rows if r[icomp] in components]
+
+    first = collections.OrderedDict()
+    for r in table:
+        group = tuple([r[i] for i in igroup])
+        if group not in first or float(r[ival]) < float(first[group][ival]):
+            first[group] = r
+    for r in first.values():
+        r = list(r)
+        r[header.index('n')] = 0
+        r[header.index('nvar')] = 0
+        table.append(r)
+
+    def key(r):
+        return [_sort_key(r[i]) for i in igroup] + [float(r[ival]), float(r[header.index('n')])]
+    table.sort(key = key)
+
+    outHeader = ['component'] + compColumns + [c for c in header if c != 'component']
+    outRows = ([r[icomp]] + components[r[icomp]] + r[:icomp] + r[icomp + 1:] for r in table)
+    write_aligned_text(outHeader, outRows, outPath)
+
+def _sort_key(value):
+    try:
+        return (0, float(value), '')
+    except ValueError:
+        return (1, 0.0, value)
+
+##__________________________________________________________________||
+def reduce_event_subset(inPath, outPath, columns, skip = 1, nevents = 6,
+                        evtColumn = 'evt'):
+    """select the rows of a few events from a table in one pass
+
+    The rows of the events with the (`skip` + 1)-th to (`skip` +
+    `nevents`)-th smallest event numbers in `evtColumn` are written with
+    the `columns`. This is the same selection as, in R,
+    `sort(unique(tbl$evt))[2:7]` for the default values. At most the
+    rows of `skip` + `nevents` events are held in memory.
+
+    """
+    header, rows = read_table(inPath)
+    ievt = header.index(evtColumn)
+    indices = [header.index(c) for c in columns]
+
+    nkeep = skip + nevents
+    events = { } # evt -> rows
+    for row in rows:
+        evt = float(row[ievt])
+        if evt not in events:
+            if len(events) >= nkeep and evt > max(events): continue
+            events[evt] = [ ]
+            if len(events) > nkeep: del events[max(events)]
+        events[evt].append([row[i] for i in indices])
+
+    outRows = (r for evt in sorted(events)[skip:] for r in events[evt])
+    write_aligned_text(columns, outRows, outPath)
+
+##__________________________________________________________________||
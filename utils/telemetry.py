@@ -0,0 +1,318 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os
+import json
+import time
+import socket
+import logging
+import threading
+
+try:
+    from urllib2 import urlopen, Request
+except ImportError:
+    from urllib.request import urlopen, Request
+
+import alphatwirl
+
+from resource_usage import EventCountingProgressReporter
+
+##__________________________________________________________________||
+class TelemetrySink(object):
+    """Write telemetry records as JSON lines to a file or an HTTP endpoint
+
+    If `target` starts with `http://`, each record is sent in a POST
+    request, e.g., to `http://localhost:8000/`. Otherwise, `target` is
+    the path to a file, to which each record is appended as a line.
+
+    This object is sent to the workers with the event loops. The file
+    needs to be on a file system shared with the workers and the
+    endpoint needs to be reachable from the workers, which is not the
+    case for `localhost` in the htcondor mode.
+
+    Errors in writing are logged once and otherwise ignored so that
+    the telemetry does not stop the processing.
+
+    """
+    def __init__(self, target, timeout = 2):
+        self.target = target
+        self.timeout = timeout
+        self._failed = False
+
+    def __repr__(self):
+        return '{}(target = {!r}, timeout = {!r})'.format(
+            self.__class__.__name__,
+            self.target,
+            self.timeout
+        )
+
+    def emit(self, record):
+        line = json.dumps(record, sort_keys = True)
+        try:
+            if self.target.startswith('http://'):
+                self._post(line)
+            else:
+                self._append(line)
+        except Exception as e:
+            if self._failed: return
+            self._failed = True
+            logger = logging.getLogger(__name__)
+            logger.warning('cannot write telemetry to {}: {}'.format(self.target, e))
+
+    def _post(self, line):
+        request = Request(self.target, data = line.encode('utf-8'), headers = {'Content-Type': 'application/json'})
+        urlopen(request, timeout = self.timeout).close()
+
+    def _append(self, line):
+        dirname = os.path.dirname(self.target)
+        if dirname and not os.path.isdir(dirname):
+            alphatwirl.mkdir_p(dirname)
+        # a single write to a file opened in the append mode so that
+        # lines from different processes are not mixed
+        with open(self.target, 'a') as f:
+            f.write(line + '\n')
+
+##__________________________________________________________________||
+class TimedReader(object):
+    """A reader that measures the time spent in `event()` of another reader
+
+    """
+    def __init__(self, reader, name = None):
+        self.reader = reader
+        self.name = name if name is not None else reader.__class__.__name__
+        self.seconds = 0.0
+
+    def __repr__(self):
+        return '{}(reader = {!r}, name = {!r})'.format(
+            self.__class__.__name__,
+            self.reader,
+            self.name
+        )
+
+    def begin(self, event):
+        self.seconds = 0.0
+        if hasattr(self.reader, 'begin'): self.reader.begin(event)
+
+    def event(self, event):
+        t0 = time.time()
+        self.reader.event(event)
+        self.seconds += time.time() - t0
+
+    def end(self):
+        if hasattr(self.reader, 'end'): self.reader.end()
+
+##__________________________________________________________________||
+class TelemetryEventLoop(object):
+    """An event loop that emits its throughput
+
+    This class is sent to workers in place of the event loop. A record
+    of the type `progress` with the number of events per second since
+    the previous record is emitted every `interval` seconds while the
+    event loop runs, unless `interval` is `None`. When the event loop
+    finishes, a record of the type `task` is emitted with the number of
+    events per second, the bytes read by the process during the event
+    loop, and the time spent in each `TimedReader`. The result of the
+    event loop is returned unchanged.
+
+    The events are counted from the progress reports with
+    `resource_usage.EventCountingProgressReporter`.
+
+    """
+    def __init__(self, eventLoop, sink, interval = None):
+        self.eventLoop = eventLoop
+        self.sink = sink
+        self.interval = interval
+
+    def __repr__(self):
+        return '{}(eventLoop = {!r}, sink = {!r}, interval = {!r})'.format(
+            self.__class__.__name__,
+            self.eventLoop,
+            self.sink,
+            self.interval
+        )
+
+    def __call__(self, progressReporter = None):
+        innermost = self._innermost_event_loop()
+        config = innermost.build_events.config
+        task = dict(
+            host = socket.gethostname(),
+            pid = os.getpid(),
+            dataset = config.name,
+            files = list(config.inputPaths),
+            start = config.start,
+        )
+
+        reporter = EventCountingProgressReporter(progressReporter)
+        if self.interval is not None:
+            reporter.every(self.interval, self._emitter_of_progress(task))
+        rchar_start = read_bytes()
+        time_start = time.time()
+        result = self.eventLoop(reporter)
+        runtime = time.time() - time_start
+        rchar_end = read_bytes()
+
+        readers = getattr(innermost.reader, 'readers', [ ])
+        nevents = reporter.nevents
+        record = dict(
+            type = 'task',
+            time = time.time(),
+            nevents = nevents,
+            runtime = runtime,
+            events_per_second = nevents/runtime if runtime > 0 else None,
+            bytes_read = rchar_end - rchar_start if None not in (rchar_start, rchar_end) else None,
+            reader_seconds = dict([(r.name, r.seconds) for r in readers if isinstance(r, TimedReader)]),
+        )
+        record.update(task)
+        self.sink.emit(record)
+        return result
+
+    def _emitter_of_progress(self, task):
+        last = dict(time = time.time(), nevents = 0)
+        def emit(nevents):
+            now = time.time()
+            seconds = now - last['time']
+            record = dict(
+                type = 'progress',
+                time = now,
+                nevents = nevents,
+                events_per_second = (nevents - last['nevents'])/seconds if seconds > 0 else None,
+            )
+            record.update(task)
+            self.sink.emit(record)
+            last.update(dict(time = now, nevents = nevents))
+        return emit
+
+    def _innermost_event_loop(self):
+        # the event loop can be wrapped, e.g., in MeasuredEventLoop
+        ret = self.eventLoop
+        for _ in range(10):
+            if hasattr(ret, 'build_events'):
+                return ret
+            ret = getattr(ret, 'eventLoop', None)
+            if ret is None: break
+        raise ValueError('cannot find an event loop with build_events in {!r}'.format(self.eventLoop))
+
+##__________________________________________________________________||
+class TelemetryEventLoopRunner(object):
+    """An event loop runner that emits telemetry
+
+    This class wraps another event loop runner, e.g.,
+    `MPEventLoopRunner`. Event loops are sent as `TelemetryEventLoop`,
+    which emit records of the throughput of each task from the workers
+    every `interval` seconds and at the end. In addition, a thread
+    emits the numbers of the tasks and the estimated time to finish
+    every `interval` seconds from `begin()` to `end()`.
+
+    Args:
+        runner: the event loop runner to wrap
+        sink (TelemetrySink): where the records are written
+        dropbox: the drop box of the communication channel, from which
+                 the numbers of outstanding tasks are read, e.g.,
+                 `MultiprocessingDropbox` or `TaskPackageDropbox`.
+                 Only the total numbers of tasks are given if `None`.
+        interval (float): the interval in seconds
+
+    """
+    def __init__(self, runner, sink, dropbox = None, interval = 30):
+        self.runner = runner
+        self.sink = sink
+        self.dropbox = dropbox
+        self.interval = interval
+
+    def __repr__(self):
+        return '{}(runner = {!r}, sink = {!r}, dropbox = {!r}, interval = {!r})'.format(
+            self.__class__.__name__,
+            self.runner,
+            self.sink,
+            self.dropbox,
+            self.interval
+        )
+
+    def begin(self):
+        self.runner.begin()
+        self.ntasks = 0
+        self.time_start = time.time()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target = self._emit_status_periodically)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self, eventLoop):
+        self.runner.run(TelemetryEventLoop(eventLoop, self.sink, interval = self.interval))
+        self.ntasks += 1
+
+    def end(self):
+        try:
+            return self.runner.end()
+        finally:
+            self._stop.set()
+            self._thread.join()
+            self.sink.emit(self._status(finished = True))
+
+    def _emit_status_periodically(self):
+        while not self._stop.wait(self.interval):
+            self.sink.emit(self._status())
+
+    def _status(self, finished = False):
+        now = time.time()
+        elapsed = now - self.time_start
+        outstanding, running = (0, 0) if finished else dropbox_task_counts(self.dropbox)
+        ret = dict(
+            type = 'status',
+            time = now,
+            host = socket.gethostname(),
+            elapsed = elapsed,
+            tasks_total = self.ntasks,
+            tasks_outstanding = outstanding,
+            tasks_running = running,
+            tasks_pending = outstanding - running if None not in (outstanding, running) else None,
+            eta_seconds = None,
+        )
+        if outstanding is not None:
+            nfinished = self.ntasks - outstanding
+            ret['tasks_finished'] = nfinished
+            if nfinished > 0:
+                ret['eta_seconds'] = elapsed/nfinished*outstanding
+        return ret
+
+##__________________________________________________________________||
+def dropbox_task_counts(dropbox):
+    """return the numbers of outstanding tasks and running tasks
+
+    `None` for the numbers that are unknown.
+
+    """
+    if dropbox is None:
+        return None, None
+
+    if hasattr(dropbox, 'n_ongoing_tasks'): # MultiprocessingDropbox
+        outstanding = dropbox.n_ongoing_tasks
+        return outstanding, min(outstanding, dropbox.n_workers)
+
+    if hasattr(dropbox, 'package_index_runids'): # SpeculativeTaskPackageDropbox
+        outstanding = len(dropbox.package_index_runids)
+    elif hasattr(dropbox, 'runid_package_index_map'): # TaskPackageDropbox
+        outstanding = len(dropbox.runid_package_index_map)
+    else:
+        return None, None
+
+    # all subprocesses run at the same time. jobs can be idle in htcondor
+    subprocess_mode = isinstance(getattr(dropbox, 'dispatcher', None), alphatwirl.concurrently.SubprocessRunner)
+    return outstanding, outstanding if subprocess_mode else None
+
+##__________________________________________________________________||
+def read_bytes():
+    """return the number of bytes read by this process or `None`
+
+    `rchar` in `/proc/self/io`, which is only available on Linux,
+    includes bytes read from the page cache and over the network.
+
+    """
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return None
+
+##__________________________________________________________________||
@@ -0,0 +1,133 @@
+# Tai Sakuma <tai.sakuma@cern.ch>
+import os
+import logging
+
+import framework_cmsedm
+
+##__________________________________________________________________||
+def add_dataset_arguments(parser):
+    """add the options for the input files and how they are split
+
+    The options common to `twirl.py` and `twirl_scan.py`.
+
+    """
+    parser.add_argument("--input-files", default = [ ], nargs = '*', help = "list of input files")
+    parser.add_argument("--dataset-names", default = [ ], nargs = '*', help = "list of data set names. the input files with the same name are in one data set")
+    parser.add_argument('-n', '--nevents', default = -1, type = int, help = 'maximum number of events to process for each component')
+    parser.add_argument('--max-events-per-process', default = -1, type = int, help = 'maximum number of events per process')
+    parser.add_argument('--max-files-per-dataset', default = -1, type = int, help = 'maximum number of files per data set')
+    parser.add_argument('--max-files-per-process', default = 1, type = int, help = 'maximum number of files per process')
+    parser.add_argument('--split-files', action = 'store_true', default = False, help = 'split data sets with fewer files than processes into event ranges run in parallel')
+    parser.add_argument('--min-events-per-range', default = 1000, type = int, help = 'minimum number of events in a range with --split-files')
+    parser.add_argument('--file-index-path', default = None, help = 'path to a file in which the number of events in each input file is recorded and read back')
+
+def add_framework_arguments(parser, process = 4):
+    """add the options for the tables, the resource usage, the
+    telemetry, the concurrency, and the logging
+
+    The options common to `twirl.py` and `twirl_scan.py`. `process` is
+    the default number of processes.
+
+    """
+    parser.add_argument('--force', action = 'store_true', default = False, help = 'recreate all output files')
+    parser.add_argument('--max-rows-in-memory', default = -1, type = int, help = 'merge tables on disk. the processes write the rows of their tables into files, except in the htcondor mode, in which at most this number of rows are buffered in memory for each table')
+    parser.add_argument('--resource-usage-path', default = None, help = 'path to a file in which runtime and memory usage of each input file are recorded and read back')
+    parser.add_argument('--target-minutes-per-process', default = -1, type = float, help = 'pack files into processes of about this runtime, based on the recorded runtime')
+    parser.add_argument('--telemetry', default = None, help = 'path to a file or an http:// URL to which the events per second of each process, the number of queued processes, and the ETA are written as JSON lines')
+    parser.add_argument('--telemetry-interval', default = 30, type = float, help = 'interval in seconds of the records of the throughput of each process and of the ETA in the telemetry')
+
+    parser.add_argument('--parallel-mode', default = 'multiprocessing', choices = ['multiprocessing', 'subprocess', 'htcondor'], help = 'mode for concurrency')
+    parser.add_argument('--straggler-factor', default = None, type = float, help = 'in the subprocess and htcondor modes, launch a duplicate of a process running longer than this factor times the median')
+    parser.add_argument('--interleave-datasets', action = 'store_true', default = False, help = 'send the processes of the data sets in turn rather than data set by data set, e.g., so that --straggler-factor has enough finished processes of each data set early')
+    parser.add_argument('-p', '--process', default = process, type = int, help = 'number of processes to run in parallel')
+    parser.add_argument('-q', '--quiet', default = False, action = 'store_true', help = 'quiet mode')
+    parser.add_argument('--profile', action = 'store_true', help = 'run profile')
+    parser.add_argument('--profile-out-path', default = None, help = 'path to write the result of profile')
+    parser.add_argument('--logging-level', default = 'WARN', choices = ['DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL'], help = 'level for logging')
+
+##__________________________________________________________________||
+def check_arguments(parser, args):
+    if args.split_files and args.target_minutes_per_process > 0:
+        parser.error('--split-files cannot be used with --target-minutes-per-process')
+
+def configure_logger(args):
+    log_level = logging.getLevelName(args.logging_level)
+    log_handler = logging.StreamHandler()
+    log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    log_handler.setFormatter(log_formatter)
+
+    names_for_logger = ["framework_cmsedm", "alphatwirl"]
+    for n in names_for_logger:
+        logger = logging.getLogger(n)
+        logger.setLevel(log_level)
+        logger.handlers[:] = [ ]
+        logger.addHandler(log_handler)
+
+##__________________________________________________________________||
+def build_framework(args, datasets, **kwargs):
+    """return `FrameworkCMSEDM` configured with the common options
+
+    `kwargs` are given to `FrameworkCMSEDM` in addition, e.g., the
+    options of the preview mode of `twirl.py`.
+
+    """
+    request_memory = 250
+    if args.resource_usage_path:
+        resource_usage = framework_cmsedm.ResourceUsage(args.resource_usage_path)
+        request_memory = resource_usage.request_memory_mb(datasets, default = request_memory)
+    htcondor_job_desc_extra_request = ['request_memory = {}'.format(request_memory)]
+
+    # absolute because the processes run in the working area in the
+    # subprocess mode
+    telemetry = args.telemetry
+    if telemetry and not telemetry.startswith('http://'):
+        telemetry = os.path.abspath(telemetry)
+
+    # https://lists.cs.wisc.edu/archive/htcondor-users/2014-June/msg00133.shtml
+    # hold a job and release to a different machine after a certain minutes
+    htcondor_job_desc_extra_resubmit = [
+        'expected_runtime_minutes = 10',
+        'job_machine_attrs = Machine',
+        'job_machine_attrs_history_length = 4',
+        'requirements = target.machine =!= MachineAttrMachine1 && target.machine =!= MachineAttrMachine2 &&  target.machine =!= MachineAttrMachine3',
+        'periodic_hold = JobStatus == 2 && CurrentTime - EnteredCurrentStatus > 60 * $(expected_runtime_minutes)',
+        'periodic_hold_subcode = 1',
+        'periodic_release = HoldReasonCode == 3 && HoldReasonSubCode == 1 && JobRunCount < 3',
+        'periodic_hold_reason = ifthenelse(JobRunCount<3,"Ran too long, will retry","Ran too long")',
+    ]
+
+    # http://www.its.hku.hk/services/research/htc/jobsubmission
+    # avoid the machines "smXX.hadoop.cluster"
+    # operator '=!=' explained at https://research.cs.wisc.edu/htcondor/manual/v7.8/4_1HTCondor_s_ClassAd.html#ClassAd:evaluation-meta
+    htcondor_job_desc_extra_blacklist = [
+        'requirements = strcmp(substr(Target.Machine,0,2),"sm") =!= 0 && strcmp(substr(Target.Machine,4,15),".hadoop.cluster") =!= 0'
+    ]
+
+    ## htcondor_job_desc_extra = htcondor_job_desc_extra_request + htcondor_job_desc_extra_resubmit
+    htcondor_job_desc_extra = htcondor_job_desc_extra_request + htcondor_job_desc_extra_blacklist
+
+    return framework_cmsedm.FrameworkCMSEDM(
+        quiet = args.quiet,
+        parallel_mode = args.parallel_mode,
+        htcondor_job_desc_extra = htcondor_job_desc_extra,
+        straggler_factor = args.straggler_factor,
+        process = args.process,
+        user_modules = ('scribbler', ),
+        max_events_per_dataset = args.nevents,
+        max_events_per_process = args.max_events_per_process,
+        max_files_per_dataset = args.max_files_per_dataset,
+        max_files_per_process = args.max_files_per_process,
+        profile = args.profile,
+        profile_out_path = args.profile_out_path,
+        resource_usage_path = args.resource_usage_path,
+        target_runtime_per_process = args.target_minutes_per_process*60,
+        file_index_path = args.file_index_path,
+        split_files_into_ranges = args.split_files,
+        min_events_per_range = args.min_events_per_range,
+        interleave_datasets = args.interleave_datasets,
+        telemetry = telemetry,
+        telemetry_interval = args.telemetry_interval,
+        **kwargs
+    )
+
+##__________________________________________________________________||